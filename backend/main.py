@@ -1,24 +1,38 @@
+import asyncio
 import logging
 import traceback
-from pathlib import Path
+from contextlib import asynccontextmanager
+import openai
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from dotenv import load_dotenv
+from pydantic import BaseModel, TypeAdapter
 
-from mcp_agent import request_toolkit_async
+from mcp_agent import request_toolkit_async, start_mcp_server, stop_mcp_server
 from actions import AgentAction, execute_action
 from agent_suggestions import generate_agent_suggestions
 from calendar_journal import get_upcoming_calendar_events, get_recent_journal_entries
 
-# Load .env file from backend directory or project root
-load_dotenv()
-load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+# .env (backend directory, then project root) is loaded once by mcp_agent at import
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Self-Care Toolkit API")
+# Compiled once; validate_python skips the kwargs binding of AgentAction(**data)
+_ACTION_ADAPTER = TypeAdapter(AgentAction)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the MCP server pool so the first request doesn't pay the spawn + handshake
+    try:
+        await start_mcp_server()
+    except Exception as exc:
+        logger.warning(f"Could not start MCP server at startup, will retry on first request: {exc}")
+    yield
+    await stop_mcp_server()
+
+
+app = FastAPI(title="Self-Care Toolkit API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +43,29 @@ app.add_middleware(
 )
 
 
+def _exception_chain(exc: BaseException):
+    """Yield exc and the exceptions it was raised from (the MCP path wraps OpenAI errors)."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def upstream_error_to_http(exc: Exception) -> HTTPException:
+    """Map an upstream LLM failure to a retryable status code when possible."""
+    error_msg = str(exc)
+    for cause in _exception_chain(exc):
+        if isinstance(cause, openai.RateLimitError):
+            # Out of credit is a billing failure, not something a retry will fix
+            if cause.code == "insufficient_quota":
+                break
+            return HTTPException(status_code=429, detail=error_msg, headers={"Retry-After": "5"})
+        if isinstance(cause, (openai.APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+            return HTTPException(status_code=504, detail=error_msg)
+    return HTTPException(status_code=500, detail=error_msg)
+
+
 class ToolkitRequest(BaseModel):
     struggle: str
     mood: str
@@ -79,11 +116,8 @@ async def toolkit(request: ToolkitRequest):
         error_msg = str(exc)
         error_trace = traceback.format_exc()
         logger.error(f"Error in /api/toolkit: {error_msg}\n{error_trace}")
-        # Return detailed error message for frontend
-        raise HTTPException(
-            status_code=500, 
-            detail=error_msg
-        )
+        # Return detailed error message for frontend (429/504 for retryable upstream failures)
+        raise upstream_error_to_http(exc)
 
 
 @app.post("/api/agent_suggestions")
@@ -105,21 +139,19 @@ async def agent_suggestions(request: AgentSuggestionsRequest):
         
         logger.info(f"Generated {len(result.actions)} agent suggestions")
         
-        # Log the actual response being sent to frontend
-        response_dict = result.dict()
-        for idx, action in enumerate(response_dict.get('actions', [])):
-            if action.get('type') == 'create_calendar_block':
-                logger.info(f"[Response] Calendar action {idx + 1} time_window: {action.get('params', {}).get('time_window', 'NOT_SET')}")
+        response_dict = result.model_dump(mode="json")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "calendar_time_windows=%s",
+                [a["params"].get("time_window") for a in response_dict["actions"] if a["type"] == "create_calendar_block"],
+            )
         
         return response_dict
     except Exception as exc:
         error_msg = str(exc)
         error_trace = traceback.format_exc()
         logger.error(f"Error in /api/agent_suggestions: {error_msg}\n{error_trace}")
-        raise HTTPException(
-            status_code=500,
-            detail=error_msg
-        )
+        raise upstream_error_to_http(exc)
 
 
 @app.post("/api/execute_action")
@@ -130,7 +162,7 @@ async def execute_action_endpoint(request: ExecuteActionRequest):
         
         # Validate action
         try:
-            action = AgentAction(**request.action)
+            action = _ACTION_ADAPTER.validate_python(request.action)
         except Exception as e:
             raise HTTPException(
                 status_code=400,
@@ -148,10 +180,7 @@ async def execute_action_endpoint(request: ExecuteActionRequest):
         error_msg = str(exc)
         error_trace = traceback.format_exc()
         logger.error(f"Error in /api/execute_action: {error_msg}\n{error_trace}")
-        raise HTTPException(
-            status_code=500,
-            detail=error_msg
-        )
+        raise upstream_error_to_http(exc)
 
 
 @app.get("/api/calendar_events")
@@ -1,309 +1,607 @@
-import json
+import logging
 import os
+import re
+import secrets
+import socket
+import subprocess
 import sys
 import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional
 
+import anyio
+import httpx
+import orjson
 from agents import Agent, Runner
-from agents.mcp import MCPServerStdio
-
-from prompts import user_prompt_template
-
-# Patch MCP client timeout - the SDK has a hardcoded 5-second timeout we need to override
-try:
-    import mcp
-    import mcp.client.stdio
-    import mcp.client.session
-    
-    # Try to find and patch the timeout constant
-    # The MCP SDK might have a DEFAULT_TIMEOUT or similar constant
-    for module_name in ['mcp.client.stdio', 'mcp.client.session', 'mcp']:
-        try:
-            module = __import__(module_name, fromlist=[''])
-            for attr_name in dir(module):
-                attr = getattr(module, attr_name)
-                # Look for timeout-related constants
-                if 'timeout' in attr_name.lower() and isinstance(attr, (int, float)):
-                    if attr == 5.0:  # If it's the 5-second timeout
-                        setattr(module, attr_name, 90.0)
-        except:
-            pass
-    
-    # Patch StdioClient initialization
-    if hasattr(mcp.client.stdio, 'StdioClient'):
-        StdioClient = mcp.client.stdio.StdioClient
-        original_init = StdioClient.__init__
-        
-        def patched_init(self, *args, **kwargs):
-            # Force timeout to 90 seconds
-            kwargs['timeout'] = 90.0
-            return original_init(self, *args, **kwargs)
-        StdioClient.__init__ = patched_init
-    
-    # Note: Removed broken monkey-patching code that was causing coroutine warnings
-            
-except (ImportError, AttributeError, Exception) as e:
-    # If patching fails, log but continue
-    import logging
-    logging.warning(f"Could not patch MCP client timeout: {e}")
-    pass
+from agents.mcp import MCPServer, MCPServerStdio, MCPServerStreamableHttp
+from dotenv import load_dotenv
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+from openai import AsyncOpenAI
+from pydantic import ValidationError
+
+from prompts import CRISIS_TOOLKIT, SYSTEM_PROMPT, is_crisis_input, render_toolkit_prompt
+from toolkit_schema import TOOLKIT_ADAPTER, TOOLKIT_RESPONSE_FORMAT
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# Read .env once at import (before the settings below) rather than on the request
+# path, stopping at the first file that provides the API key
+for _dotenv_path in (Path(__file__).resolve().parent / ".env", PROJECT_ROOT / ".env", Path.cwd() / ".env"):
+    if _dotenv_path.exists():
+        load_dotenv(dotenv_path=_dotenv_path)
+        if os.getenv("OPENAI_API_KEY"):
+            break
 MCP_DIR = PROJECT_ROOT / "selfcare-mcp-agent"
 MCP_SCRIPT = MCP_DIR / "mcp-server" / "selfcare_mcp.py"
 
+# The server script location is static - resolve it once instead of on every request
+if not MCP_SCRIPT.exists():
+    raise RuntimeError(f"MCP server script not found at {MCP_SCRIPT}")
+_SCRIPT_PATH = str(MCP_SCRIPT.resolve())
+_CWD_PATH = str(MCP_DIR.resolve())
 
-async def _run_agent(prompt: str) -> Dict[str, Any]:
-    """Call the MCP tool directly to avoid timeout issues with openai-agents library."""
+logger = logging.getLogger(__name__)
 
-    import logging
-    logger = logging.getLogger(__name__)
-
-    # Get OPENAI_API_KEY from environment to pass to MCP server
-    env = os.environ.copy()
-    if "OPENAI_API_KEY" not in env:
-        # Try to load from .env file
-        from dotenv import load_dotenv
-        load_dotenv()
-        if "OPENAI_API_KEY" in os.environ:
-            env["OPENAI_API_KEY"] = os.environ["OPENAI_API_KEY"]
-
-    # Verify MCP script exists
-    if not MCP_SCRIPT.exists():
-        raise RuntimeError(f"MCP server script not found at {MCP_SCRIPT}")
-
-    # Set MCP client timeout environment variables (try multiple possible names)
-    env["MCP_CLIENT_TIMEOUT"] = "90"
-    env["MCP_TIMEOUT"] = "90"
-    env["MCP_REQUEST_TIMEOUT"] = "90"
-    env["MCP_TOOL_TIMEOUT"] = "90"
-    env["TIMEOUT"] = "90"
+MCP_POOL_SIZE = max(1, int(os.getenv("MCP_POOL_SIZE", "4")))
+# Per-request timeout for MCP calls (the agents SDK defaults to 5 seconds)
+MCP_CLIENT_SESSION_TIMEOUT = float(os.getenv("MCP_CLIENT_SESSION_TIMEOUT", "120"))
 
-    try:
-        logger.info(f"Starting MCP server: {sys.executable} {MCP_SCRIPT}")
-        logger.info(f"MCP script exists: {MCP_SCRIPT.exists()}")
-        logger.info(f"MCP directory: {MCP_DIR}")
-        logger.info(f"OPENAI_API_KEY in env: {'OPENAI_API_KEY' in env}")
-        
-        # Use absolute path for script and ensure cwd is correct
-        script_path = str(MCP_SCRIPT.resolve())
-        cwd_path = str(MCP_DIR.resolve())
-        
-        logger.info(f"Script absolute path: {script_path}")
-        logger.info(f"CWD absolute path: {cwd_path}")
+# "streamable-http" runs one long-lived MCP server process that every pool slot
+# shares; "stdio" spawns one subprocess per slot.
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "streamable-http")
+MCP_HTTP_HOST = os.getenv("MCP_HTTP_HOST", "127.0.0.1")
+# 0 picks a free port at spawn time, so each uvicorn worker runs its own server
+MCP_HTTP_PORT = int(os.getenv("MCP_HTTP_PORT", "0"))
+
+# The HTTP server's tools act with the user's Google token and OpenAI key, so the
+# server we spawn only accepts requests carrying this per-process secret
+_MCP_AUTH_TOKEN = secrets.token_urlsafe(32)
+
+# Toolkit generation is a single deterministic tool call, so by default it goes
+# straight to OpenAI. Set TOOLKIT_VIA_MCP=1 to route it through the MCP agent.
+TOOLKIT_VIA_MCP = os.getenv("TOOLKIT_VIA_MCP", "0") == "1"
+TOOLKIT_MODEL = "gpt-5-nano"
+
+_openai_client: Optional[AsyncOpenAI] = None
+
+# MCP client timeout environment variables (try multiple possible names), merged
+# into the server's environment once instead of copying os.environ per spawn
+_MCP_ENV_OVERLAY = {
+    "MCP_CLIENT_TIMEOUT": "90",
+    "MCP_TIMEOUT": "90",
+    "MCP_REQUEST_TIMEOUT": "90",
+    "MCP_TOOL_TIMEOUT": "90",
+    "TIMEOUT": "90",
+}
+_SERVER_ENV = {**os.environ, **_MCP_ENV_OVERLAY}
+
+# Failures that mean the MCP connection itself is broken, as opposed to errors
+# from the request (bad model output, rate limits) that leave the session usable
+_TRANSPORT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    httpx.TransportError,
+    OSError,
+)
+
+
+def _is_transport_failure(exc: Optional[BaseException]) -> bool:
+    """Check exc and the exceptions it was raised from (the agents SDK wraps tool errors)."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, _TRANSPORT_ERRORS):
+            return True
+        if isinstance(exc, McpError) and exc.error.code == CONNECTION_CLOSED:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class _PoolSlot:
+    """One pool position; the generation increments each time its server is replaced."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.generation = 0
+        self.leased = False
+        self.server: Optional[MCPServer] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.server is not None and self._task is not None and not self._task.done()
+
+
+class MCPServerPool:
+    """Fixed-size pool of warm MCP server connections.
+
+    Each slot owns its own client session (and, over stdio, its own server
+    subprocess), so concurrent requests run their tool calls in parallel instead
+    of queueing on a single connection. A slot's connection is opened and closed
+    inside a dedicated task because the MCP clients must be exited from the task
+    that entered them.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = [_PoolSlot(i) for i in range(size)]
+        self._idle: asyncio.Queue[_PoolSlot] = asyncio.Queue()
+        self._start_lock = asyncio.Lock()
+        self._started = False
+
+    async def start(self) -> None:
+        """Connect every slot concurrently."""
+        async with self._start_lock:
+            if self._started:
+                return
+            results = await asyncio.gather(
+                *(self._connect(slot) for slot in self._slots), return_exceptions=True
+            )
+            for slot, outcome in zip(self._slots, results):
+                if isinstance(outcome, Exception):
+                    # Leave the slot empty; acquire() retries the connection lazily
+                    logger.warning("MCP pool slot %d failed to connect: %s", slot.index, outcome)
+                # A slot still leased from before a close() is queued again by release()
+                if not slot.leased:
+                    self._idle.put_nowait(slot)
+            self._started = True
+            logger.info("MCP server pool ready (%d slots)", self.size)
+
+    async def close(self) -> None:
+        """Shut down every connected server."""
+        # Empty the idle queue so the next start() does not queue the slots twice
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        await asyncio.gather(*(self._discard(slot) for slot in self._slots))
+        self._started = False
+
+    async def acquire(self) -> _PoolSlot:
+        if not self._started:
+            await self.start()
+        slot = await self._idle.get()
+        slot.leased = True
+        try:
+            if not slot.healthy:
+                await self._discard(slot)
+                await self._connect(slot)
+        except BaseException:
+            self.release(slot)
+            raise
+        return slot
 
-        async with MCPServerStdio(
+    def release(self, slot: _PoolSlot) -> None:
+        slot.leased = False
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[MCPServer]:
+        slot = await self.acquire()
+        try:
+            yield slot.server
+        except BaseException as exc:
+            # Reconnect only when the connection itself failed; the session is
+            # still good after errors raised by the caller's own work
+            if not slot.healthy or _is_transport_failure(exc):
+                await self._discard(slot)
+            raise
+        finally:
+            self.release(slot)
+
+    async def _connect(self, slot: _PoolSlot) -> None:
+        if MCP_TRANSPORT != "stdio":
+            await _ensure_http_server()
+        ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._run_slot(slot, ready, stop))
+        try:
+            server = await ready
+        except BaseException:
+            stop.set()
+            task.cancel()
+            raise
+        slot.server, slot._task, slot._stop = server, task, stop
+        slot.generation += 1
+        logger.info("MCP pool slot %d connected (generation %d)", slot.index, slot.generation)
+
+    async def _run_slot(self, slot: _PoolSlot, ready: asyncio.Future, stop: asyncio.Event) -> None:
+        try:
+            async with _make_server() as server:
+                ready.set_result(server)
+                await stop.wait()
+        except asyncio.CancelledError:
+            if not ready.done():
+                ready.cancel()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning("MCP pool slot %d exited with error: %s", slot.index, e)
+
+    async def _discard(self, slot: _PoolSlot) -> None:
+        task, stop = slot._task, slot._stop
+        slot.server = slot._task = slot._stop = None
+        if task is not None:
+            stop.set()
+            try:
+                await asyncio.wait_for(task, timeout=10.0)
+            except Exception as e:
+                logger.warning("Error while closing MCP pool slot %d: %s", slot.index, e)
+
+
+def _make_server() -> MCPServer:
+    if MCP_TRANSPORT == "stdio":
+        return MCPServerStdio(
             name="Selfcare MCP Server",
             params={
                 "command": sys.executable,
-                "args": [script_path],
-                "cwd": cwd_path,
-                "env": env,
+                "args": [_SCRIPT_PATH],
+                "cwd": _CWD_PATH,
+                "env": _server_env(),
+            },
+            cache_tools_list=True,  # The tool set is fixed for the lifetime of the process
+            client_session_timeout_seconds=MCP_CLIENT_SESSION_TIMEOUT,
+        )
+    return MCPServerStreamableHttp(
+        name="Selfcare MCP Server",
+        params={
+            "url": _http_server_url,
+            "headers": {"Authorization": f"Bearer {_MCP_AUTH_TOKEN}"},
+            "timeout": MCP_CLIENT_SESSION_TIMEOUT,
+        },
+        cache_tools_list=True,
+        client_session_timeout_seconds=MCP_CLIENT_SESSION_TIMEOUT,
+    )
+
+
+_http_server_process: Optional[subprocess.Popen] = None
+_http_server_url: Optional[str] = None
+_http_server_lock = asyncio.Lock()
+
+
+async def _http_server_listening(port: int) -> bool:
+    try:
+        _, writer = await asyncio.open_connection(MCP_HTTP_HOST, port)
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+
+def _pick_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((MCP_HTTP_HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def _ensure_http_server() -> None:
+    """Make sure the MCP server this process spawned is running, starting it if needed.
+
+    A listener we did not spawn is never reused: it would receive user prompts and
+    could not check our shared secret, so an occupied port is an error.
+    """
+    global _http_server_process, _http_server_url
+
+    async with _http_server_lock:
+        if _http_server_process is not None and _http_server_process.poll() is None:
+            return
+
+        port = MCP_HTTP_PORT or _pick_free_port()
+        if await _http_server_listening(port):
+            raise RuntimeError(
+                f"Port {port} on {MCP_HTTP_HOST} is already in use by another process; "
+                "set MCP_HTTP_PORT to a free port (or 0 to pick one automatically)"
+            )
+
+        url = f"http://{MCP_HTTP_HOST}:{port}/mcp"
+        logger.info("Starting MCP server: %s %s on %s", sys.executable, _SCRIPT_PATH, url)
+        process = subprocess.Popen(
+            [sys.executable, _SCRIPT_PATH],
+            cwd=_CWD_PATH,
+            env={
+                **_server_env(),
+                "MCP_TRANSPORT": "streamable-http",
+                "MCP_HTTP_HOST": MCP_HTTP_HOST,
+                "MCP_HTTP_PORT": str(port),
+                "MCP_AUTH_TOKEN": _MCP_AUTH_TOKEN,
             },
-            client_session_timeout_seconds=120.0,  # Override default 5-second timeout
-        ) as server:
-            logger.info("MCP server connected, getting system prompt")
+        )
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 30.0
+        while not await _http_server_listening(port):
+            if process.poll() is not None:
+                raise RuntimeError(f"MCP server exited with code {process.returncode} during startup")
+            if loop.time() > deadline:
+                process.kill()
+                raise RuntimeError(f"MCP server did not start listening on {url} within 30 seconds")
+            await asyncio.sleep(0.2)
+        if process.poll() is not None:
+            # Another process bound the port first and answered our probe
+            raise RuntimeError(f"MCP server exited with code {process.returncode} during startup")
+        _http_server_process, _http_server_url = process, url
+
+
+def _stop_http_server() -> None:
+    global _http_server_process, _http_server_url
+
+    process, _http_server_process, _http_server_url = _http_server_process, None, None
+    if process is not None and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+_pool = MCPServerPool(MCP_POOL_SIZE)
+
+
+async def start_mcp_server() -> None:
+    """Warm the MCP server pool ahead of the first request (FastAPI startup hook)."""
+    logger.info("Starting MCP server pool over %s: %s %s (cwd=%s)", MCP_TRANSPORT, sys.executable, _SCRIPT_PATH, _CWD_PATH)
+    await _pool.start()
+
+
+async def stop_mcp_server() -> None:
+    """Drain the MCP server pool and stop the HTTP server we spawned (FastAPI shutdown hook)."""
+    await _pool.close()
+    _stop_http_server()
+
+
+def _server_env() -> Dict[str, str]:
+    # The MCP server needs OPENAI_API_KEY; .env was already loaded at import
+    if "OPENAI_API_KEY" not in _SERVER_ENV:
+        raise RuntimeError("OPENAI_API_KEY is not set. Please configure it in .env file in project root or backend directory.")
+    return _SERVER_ENV
+
+
+def _unwrap_tool_payload(tool_payload: str) -> Any:
+    """Decode an MCP tool output, unwrapping the {"type": "text", "text": ...} content envelope.
+
+    The agents SDK serializes a single MCP content item as-is, so the tool's own JSON
+    arrives as an escaped string inside the envelope. Decoding that string is
+    unavoidable; this keeps it to one pass per layer with no intermediate inspection.
+    """
+    parsed = orjson.loads(tool_payload)
+    if isinstance(parsed, dict) and "text" in parsed:
+        return orjson.loads(parsed["text"])
+    return parsed
+
+
+async def _run_agent(prompt: str) -> Dict[str, Any]:
+    """Call the MCP tool directly to avoid timeout issues with openai-agents library."""
+
+    try:
+        async with _pool.lease() as server:
+            # For suggestions, we might want to use a different system prompt
+            # that doesn't encourage tool usage. But for now, use the MCP system prompt.
+            agent = Agent(
+                name="Self-Care Companion",
+                instructions=SYSTEM_PROMPT,
+                mcp_servers=[server],
+            )
+
+            input_items: List[Dict[str, str]] = [{"role": "user", "content": prompt}]
+            logger.info("Starting agent execution")
+            logger.info("User prompt (first 200 chars): %.200s...", prompt)
+            result = Runner.run_streamed(agent, input=input_items)
+
+            tool_payload = None
+            text_output = None
+            all_outputs = []
+            # Wrap the event streaming with a longer timeout to handle slow API responses
             try:
-                prompt_result = await server.get_prompt("system_prompt")
-                instructions = prompt_result.messages[0].content.text
-                logger.info("System prompt retrieved successfully")
-
-                # For suggestions, we might want to use a different system prompt
-                # that doesn't encourage tool usage. But for now, use the MCP system prompt.
-                agent = Agent(
-                    name="Self-Care Companion",
-                    instructions=instructions,
-                    mcp_servers=[server],
-                )
-
-                input_items: List[Dict[str, str]] = [{"role": "user", "content": prompt}]
-                logger.info("Starting agent execution")
-                logger.info(f"User prompt (first 200 chars): {prompt[:200]}...")
-                result = Runner.run_streamed(agent, input=input_items)
-
-                tool_payload = None
-                text_output = None
-                all_outputs = []
-                # Wrap the event streaming with a longer timeout to handle slow API responses
-                try:
-                    async def collect_events():
-                        nonlocal tool_payload, text_output, all_outputs
-                        async for event in result.stream_events():
-                            logger.info(f"Event received - type: {event.type}, item type: {getattr(event.item, 'type', 'N/A') if hasattr(event, 'item') else 'N/A'}")
-                            if event.type == "run_item_stream_event":
-                                item_type = getattr(event.item, 'type', 'unknown')
-                                logger.info(f"Processing item type: {item_type}")
-                                
-                                if item_type == "tool_call_output_item":
-                                    tool_payload = event.item.output
-                                    logger.info(f"Tool output received: {str(tool_payload)[:200] if tool_payload else 'None'}...")
-                                    all_outputs.append(("tool", tool_payload))
-                                elif item_type == "text_output_item":
-                                    text_output = event.item.output
-                                    logger.info(f"Text output received: {str(text_output)[:200] if text_output else 'None'}...")
-                                    all_outputs.append(("text", text_output))
-                                elif item_type == "message_item" or item_type == "message_output_item":
-                                    # Agent's message response
-                                    logger.info(f"Processing message item, has raw_item: {hasattr(event.item, 'raw_item')}")
-                                    if hasattr(event.item, 'raw_item') and hasattr(event.item.raw_item, 'content'):
-                                        # Extract from raw_item.content (like in the example)
-                                        content = event.item.raw_item.content
-                                        if isinstance(content, list) and len(content) > 0:
-                                            # Content is a list, get text from first item
-                                            first_content = content[0]
-                                            if hasattr(first_content, 'text'):
-                                                text_output = first_content.text
-                                            elif isinstance(first_content, dict) and 'text' in first_content:
-                                                text_output = first_content['text']
-                                            else:
-                                                text_output = str(first_content)
-                                            logger.info(f"Text output from message raw_item.content: {text_output[:200]}...")
-                                            all_outputs.append(("text", text_output))
-                                    elif hasattr(event.item, 'content'):
-                                        content = event.item.content
-                                        if isinstance(content, str):
-                                            text_output = content
-                                            logger.info(f"Text output from message content: {text_output[:200]}...")
-                                            all_outputs.append(("text", text_output))
-                                        elif isinstance(content, list) and len(content) > 0:
-                                            # Content might be a list of text parts
-                                            text_parts = [c.get('text', '') if isinstance(c, dict) else str(c) for c in content if c]
-                                            text_output = ''.join(text_parts)
-                                            logger.info(f"Text output from message content list: {text_output[:200]}...")
-                                            all_outputs.append(("text", text_output))
-                                elif hasattr(event.item, 'content') and event.item.content:
-                                    # Sometimes the output is in content
+                async def collect_events():
+                    nonlocal tool_payload, text_output, all_outputs
+                    async for event in result.stream_events():
+                        logger.debug("Event received - type: %s, item type: %s", event.type, getattr(getattr(event, "item", None), "type", "N/A"))
+                        if event.type == "run_item_stream_event":
+                            item_type = getattr(event.item, 'type', 'unknown')
+                            logger.debug("Processing item type: %s", item_type)
+                        
+                            if item_type == "tool_call_output_item":
+                                tool_payload = event.item.output
+                                logger.info("Tool output received: %.200s...", tool_payload)
+                                all_outputs.append(("tool", tool_payload))
+                                # The tool output is the result; stop the run rather than
+                                # draining the model's closing turn and usage events
+                                result.cancel()
+                                break
+                            elif item_type == "text_output_item":
+                                text_output = event.item.output
+                                logger.info("Text output received: %.200s...", text_output)
+                                all_outputs.append(("text", text_output))
+                            elif item_type == "message_item" or item_type == "message_output_item":
+                                # Agent's message response
+                                logger.debug("Processing message item, has raw_item: %s", hasattr(event.item, "raw_item"))
+                                if hasattr(event.item, 'raw_item') and hasattr(event.item.raw_item, 'content'):
+                                    # Extract from raw_item.content (like in the example)
+                                    content = event.item.raw_item.content
+                                    if isinstance(content, list) and len(content) > 0:
+                                        # Content is a list, get text from first item
+                                        first_content = content[0]
+                                        if hasattr(first_content, 'text'):
+                                            text_output = first_content.text
+                                        elif isinstance(first_content, dict) and 'text' in first_content:
+                                            text_output = first_content['text']
+                                        else:
+                                            text_output = str(first_content)
+                                        logger.info("Text output from message raw_item.content: %.200s...", text_output)
+                                        all_outputs.append(("text", text_output))
+                                elif hasattr(event.item, 'content'):
                                     content = event.item.content
                                     if isinstance(content, str):
                                         text_output = content
-                                        logger.info(f"Text output from content: {text_output[:200]}...")
+                                        logger.info("Text output from message content: %.200s...", text_output)
                                         all_outputs.append(("text", text_output))
-                                    elif isinstance(content, dict) and 'text' in content:
-                                        text_output = content['text']
-                                        logger.info(f"Text output from content.text: {text_output[:200]}...")
+                                    elif isinstance(content, list) and len(content) > 0:
+                                        # Content might be a list of text parts
+                                        text_parts = [c.get('text', '') if isinstance(c, dict) else str(c) for c in content if c]
+                                        text_output = ''.join(text_parts)
+                                        logger.info("Text output from message content list: %.200s...", text_output)
                                         all_outputs.append(("text", text_output))
-                                else:
-                                    # Log other item types for debugging
-                                    logger.info(f"Other item type: {item_type}, item attributes: {dir(event.item)}")
-                    
-                    await asyncio.wait_for(collect_events(), timeout=120.0)  # 120 second timeout
-                except asyncio.TimeoutError:
-                    raise RuntimeError("Tool execution timed out after 120 seconds. The API may be taking longer than expected.")
-
-                logger.info(f"Collected outputs: {len(all_outputs)} items (tool: {tool_payload is not None}, text: {text_output is not None})")
-
-                # If we have tool output (from generate_toolkit), parse it
-                if tool_payload:
-                    # Parse the tool output - it may be a JSON string or a structured object
-                    parsed_result = json.loads(tool_payload)
-                    logger.info(f"Parsed tool result type: {type(parsed_result)}")
-                    logger.info(f"Parsed tool result keys: {list(parsed_result.keys()) if isinstance(parsed_result, dict) else 'N/A'}")
-                    
-                    # The MCP tool output may be wrapped in a structure like {'type': 'text', 'text': '...'}
-                    # If so, we need to parse the 'text' field
-                    if isinstance(parsed_result, dict) and "text" in parsed_result:
-                        # The actual JSON is in the 'text' field
-                        inner_json = parsed_result["text"]
-                        parsed_result = json.loads(inner_json)
-                        logger.info(f"Parsed inner JSON, keys: {list(parsed_result.keys()) if isinstance(parsed_result, dict) else 'N/A'}")
-                    
-                    # The tool returns {"items": [...]}, so return it directly
-                    if isinstance(parsed_result, dict) and "items" in parsed_result:
-                        logger.info(f"Found {len(parsed_result['items'])} items")
+                            elif hasattr(event.item, 'content') and event.item.content:
+                                # Sometimes the output is in content
+                                content = event.item.content
+                                if isinstance(content, str):
+                                    text_output = content
+                                    logger.info("Text output from content: %.200s...", text_output)
+                                    all_outputs.append(("text", text_output))
+                                elif isinstance(content, dict) and 'text' in content:
+                                    text_output = content['text']
+                                    logger.info("Text output from content.text: %.200s...", text_output)
+                                    all_outputs.append(("text", text_output))
+                            else:
+                                # Log other item types for debugging
+                                logger.debug("Other item type: %s, item: %r", item_type, event.item)
+            
+                await asyncio.wait_for(collect_events(), timeout=120.0)  # 120 second timeout
+            except asyncio.TimeoutError:
+                raise RuntimeError("Tool execution timed out after 120 seconds. The API may be taking longer than expected.")
+
+            logger.info("Collected outputs: %d items (tool: %s, text: %s)", len(all_outputs), tool_payload is not None, text_output is not None)
+
+            # If we have tool output (from generate_toolkit), parse it
+            if tool_payload:
+                parsed_result = _unwrap_tool_payload(tool_payload)
+
+                # The tool returns {"items": [...]}, so return it directly
+                if isinstance(parsed_result, dict) and "items" in parsed_result:
+                    logger.info("Found %d items", len(parsed_result["items"]))
+                    return parsed_result
+                else:
+                    # Fallback: if it's already in the right format or different structure
+                    logger.warning("Unexpected result structure: %s", parsed_result)
+                    return parsed_result
+        
+            # If we have text output (direct agent response, not from a tool), parse it as JSON
+            elif text_output:
+                logger.info("Parsing text output as JSON: %.200s...", text_output)
+                try:
+                    # Try to parse as JSON directly
+                    parsed_result = orjson.loads(text_output)
+                    logger.info("Parsed text output, type: %s", type(parsed_result).__name__)
+                    return parsed_result
+                except orjson.JSONDecodeError:
+                    # If it's not valid JSON, try to extract JSON from the text
+                    json_match = re.search(r'\{.*\}', text_output, re.DOTALL)
+                    if json_match:
+                        parsed_result = orjson.loads(json_match.group())
+                        logger.info("Extracted JSON from text, type: %s", type(parsed_result).__name__)
                         return parsed_result
                     else:
-                        # Fallback: if it's already in the right format or different structure
-                        logger.warning(f"Unexpected result structure: {parsed_result}")
-                        return parsed_result
+                        raise ValueError(f"Could not parse JSON from agent text output: {text_output[:500]}")
+        
+            else:
+                logger.warning("Agent finished without emitting any output. All collected outputs: %s", all_outputs)
+                # Try to get the final response from the agent's run result
+                try:
+                    # Try different ways to get the result
+                    if hasattr(result, 'get_final_result'):
+                        final_result = result.get_final_result()
+                        logger.info("Found final result via get_final_result(): %s", type(final_result))
+                        if isinstance(final_result, str):
+                            text_output = final_result
+                        elif isinstance(final_result, dict):
+                            return final_result
                 
-                # If we have text output (direct agent response, not from a tool), parse it as JSON
-                elif text_output:
-                    logger.info(f"Parsing text output as JSON: {text_output[:200]}...")
-                    try:
-                        # Try to parse as JSON directly
-                        parsed_result = json.loads(text_output)
-                        logger.info(f"Parsed text output, keys: {list(parsed_result.keys()) if isinstance(parsed_result, dict) else 'N/A'}")
-                        return parsed_result
-                    except json.JSONDecodeError:
-                        # If it's not valid JSON, try to extract JSON from the text
-                        import re
-                        json_match = re.search(r'\{.*\}', text_output, re.DOTALL)
-                        if json_match:
-                            parsed_result = json.loads(json_match.group())
-                            logger.info(f"Extracted JSON from text, keys: {list(parsed_result.keys()) if isinstance(parsed_result, dict) else 'N/A'}")
-                            return parsed_result
-                        else:
-                            raise ValueError(f"Could not parse JSON from agent text output: {text_output[:500]}")
+                    # Try accessing result directly
+                    if hasattr(result, 'result'):
+                        final_result = result.result
+                        logger.info("Found final result via result.result: %s", type(final_result))
+                        if isinstance(final_result, str):
+                            text_output = final_result
+                        elif isinstance(final_result, dict):
+                            return final_result
                 
-                else:
-                    logger.warning(f"Agent finished without emitting any output. All collected outputs: {all_outputs}")
-                    # Try to get the final response from the agent's run result
+                    # Try iterating through all items one more time
+                    logger.info("Attempting to collect all items from result...")
+                    all_items = []
                     try:
-                        # Try different ways to get the result
-                        if hasattr(result, 'get_final_result'):
-                            final_result = result.get_final_result()
-                            logger.info(f"Found final result via get_final_result(): {type(final_result)}")
-                            if isinstance(final_result, str):
-                                text_output = final_result
-                            elif isinstance(final_result, dict):
-                                return final_result
-                        
-                        # Try accessing result directly
-                        if hasattr(result, 'result'):
-                            final_result = result.result
-                            logger.info(f"Found final result via result.result: {type(final_result)}")
-                            if isinstance(final_result, str):
-                                text_output = final_result
-                            elif isinstance(final_result, dict):
-                                return final_result
-                        
-                        # Try iterating through all items one more time
-                        logger.info("Attempting to collect all items from result...")
-                        all_items = []
-                        try:
-                            async for event in result.stream_events():
-                                if hasattr(event, 'item'):
-                                    all_items.append((event.item.type if hasattr(event.item, 'type') else 'unknown', str(event.item)[:200]))
-                            logger.info(f"Collected {len(all_items)} items on second pass: {all_items}")
-                        except Exception as e:
-                            logger.warning(f"Could not iterate events again: {e}")
-                            
+                        async for event in result.stream_events():
+                            if hasattr(event, 'item'):
+                                all_items.append((event.item.type if hasattr(event.item, 'type') else 'unknown', str(event.item)[:200]))
+                        logger.info("Collected %d items on second pass: %s", len(all_items), all_items)
                     except Exception as e:
-                        logger.warning(f"Could not get final result: {e}")
+                        logger.warning("Could not iterate events again: %s", e)
                     
-                    if not text_output:
-                        raise RuntimeError(
-                            f"Agent finished without emitting any output (neither tool output nor text output). "
-                            f"Collected {len(all_outputs)} outputs. "
-                            f"The agent may need to be instructed to return JSON directly, or it may be trying to call a tool that doesn't exist."
-                        )
-            except Exception as e:
-                logger.error(f"Error during agent execution: {e}", exc_info=True)
-                raise RuntimeError(f"Error during agent execution: {str(e)}")
+                except Exception as e:
+                    logger.warning("Could not get final result: %s", e)
+            
+                if not text_output:
+                    raise RuntimeError(
+                        f"Agent finished without emitting any output (neither tool output nor text output). "
+                        f"Collected {len(all_outputs)} outputs. "
+                        f"The agent may need to be instructed to return JSON directly, or it may be trying to call a tool that doesn't exist."
+                    )
     except Exception as e:
-        logger.error(f"Error connecting to MCP server: {e}", exc_info=True)
-        # Check if it's a connection closed error
+        # Logged once by the FastAPI handler; surface a crashed MCP server process with a clearer message
         error_msg = str(e)
-        if "Connection closed" in error_msg or "connection" in error_msg.lower():
+        if "Connection closed" in error_msg:
             raise RuntimeError(
                 f"MCP server connection closed. This usually means the MCP server process crashed. "
                 f"Check that the MCP server script exists and can run. Error: {error_msg}"
-            )
-        raise RuntimeError(f"Failed to connect to MCP server: {error_msg}")
+            ) from e
+        raise
+
 
+def build_user_prompt(*, struggle: str, mood: str, focus: str, coping_preferences: List[str] | str, energy_level: str) -> str:
+    if not isinstance(coping_preferences, str):
+        coping_preferences = ", ".join(coping_preferences)
+    return render_toolkit_prompt(struggle, mood, focus, coping_preferences, energy_level)
 
-def build_user_prompt(*, struggle: str, mood: str, focus: str, coping_preferences: List[str], energy_level: str) -> str:
-    return user_prompt_template.format(
-        struggle=struggle,
-        mood=mood,
-        focus=focus,
-        coping_preferences=", ".join(coping_preferences),
-        energy_level=energy_level,
+
+def _get_openai_client() -> AsyncOpenAI:
+    """Return the shared (connection-pooled) OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=90.0)
+    return _openai_client
+
+
+async def _generate_toolkit_direct(prompt: str) -> Dict[str, Any]:
+    """Generate the toolkit with one OpenAI call, the same request generate_toolkit makes."""
+    # Streamed like generate_toolkit so tokens are read off the socket as they are
+    # generated; validation needs the whole object, so the chunks are only joined
+    stream = await _get_openai_client().chat.completions.create(
+        model=TOOLKIT_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        response_format=TOOLKIT_RESPONSE_FORMAT,
+        stream=True,
     )
+    parts: List[str] = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    output = "".join(parts) or "{}"
+
+    try:
+        toolkit = TOOLKIT_ADAPTER.validate_json(output)
+    except ValidationError as exc:
+        logger.error("Invalid toolkit JSON from OpenAI: %s. Raw output: %s", exc, output[:500])
+        raise ValueError(f"Invalid JSON response from OpenAI: {exc}") from exc
+
+    if not toolkit.recommendations:
+        logger.error("No recommendations found in response: %s", output[:500])
+        raise ValueError("No recommendations returned from the model")
+
+    return {"items": [r.model_dump() for r in toolkit.recommendations]}
 
 
 async def request_toolkit_async(**payload: Any) -> Dict[str, Any]:
-    """Call the MCP tool using Agent approach with extended timeout handling."""
+    """Generate a toolkit, directly via OpenAI or through the MCP agent when TOOLKIT_VIA_MCP is set."""
+    if is_crisis_input(payload.get("struggle"), payload.get("mood"), payload.get("focus")):
+        logger.warning("Crisis keywords detected in toolkit request; returning crisis resources without a model call")
+        return CRISIS_TOOLKIT
     prompt = build_user_prompt(**payload)
-    return await _run_agent(prompt)
+    if TOOLKIT_VIA_MCP:
+        return await _run_agent(prompt)
+    return await _generate_toolkit_direct(prompt)
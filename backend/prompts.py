@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 system_prompt = """
 MISSION STATEMENT:
 The Self-Care Toolkit Agent exists to support college students during moments of stress, overwhelm, and emotional uncertainty by transforming how they feel right now into clear, personalized, and practical next steps. Its mission is to reduce decision fatigue, offer grounded guidance when self-care feels hard to figure out, and help students build a flexible collection of supportive strategies they can rely on during challenging times. By remembering the user's patterns, honoring their emotional state, and suggesting small, doable actions, the agent acts as a calm, trustworthy companion that helps students care for their mental, emotional, and physical wellbeing—always optional, always personalized, never generic or overwhelming.
@@ -17,6 +20,9 @@ SAFETY GUIDELINES:
 If the user's input suggests crisis or self-harm, respond only with a short safety message directing them to appropriate crisis resources and stop.
 """
 
+# Stripped once at import; used verbatim by the MCP prompt handler and both toolkit paths
+SYSTEM_PROMPT = system_prompt.strip()
+
 user_prompt_template = """
 I am struggling with {struggle}.
 My current mood is {mood}.
@@ -49,3 +55,48 @@ Format:
 }}
 """
 
+# Bound once and shared by the backend and the MCP server; callers pass a
+# prebuilt mapping of the template fields instead of keyword arguments.
+render_user_prompt = user_prompt_template.format_map
+
+
+@lru_cache(maxsize=256)
+def render_toolkit_prompt(struggle: str, mood: str, focus: str, coping_preferences: str, energy_level: str) -> str:
+    """Render the toolkit user prompt; repeated quiz answers reuse the cached string."""
+    return render_user_prompt({
+        "struggle": struggle,
+        "mood": mood,
+        "focus": focus,
+        "coping_preferences": coping_preferences,
+        "energy_level": energy_level,
+    })
+
+
+# Obvious crisis phrases are answered with a fixed safety response instead of a
+# model round-trip; subtler cases are still covered by the system prompt.
+CRISIS_PATTERN = re.compile(
+    r"\b(suicid\w*|kill myself|killing myself|self[- ]?harm\w*|hurt myself|end my life|"
+    r"want to die|don'?t want to (?:live|be alive)|no reason to live)\b",
+    re.IGNORECASE,
+)
+
+CRISIS_TOOLKIT = {
+    "items": [
+        {
+            "title": "Crisis Resources",
+            "why_it_helps": "You don't have to handle this alone. Talking to someone right now can help you stay safe.",
+            "steps": [
+                "If you are in immediate danger, call your local emergency number (911 in the US).",
+                "Call or text 988 to reach the Suicide & Crisis Lifeline (US), available 24/7.",
+                "Reach out to a trusted person or your campus counseling center and let them know how you're feeling.",
+            ],
+            "time_estimate": "Right now",
+            "difficulty": "Easy",
+        }
+    ]
+}
+
+
+def is_crisis_input(*texts: str) -> bool:
+    """Return True if any of the given free-text fields matches an obvious crisis phrase."""
+    return any(text and CRISIS_PATTERN.search(text) for text in texts)
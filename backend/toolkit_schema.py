@@ -0,0 +1,71 @@
+"""
+Toolkit response schema shared by the backend and the MCP server.
+Mirrors the JSON format requested in prompts.user_prompt_template.
+"""
+from typing import List
+
+from pydantic import BaseModel, TypeAdapter
+
+
+class Recommendation(BaseModel):
+    title: str
+    why_it_helps: str
+    steps: List[str]
+    time_estimate: str
+    difficulty: str
+
+
+class Toolkit(BaseModel):
+    recommendations: List[Recommendation]
+
+
+class ToolkitBatch(BaseModel):
+    results: List[Toolkit]
+
+
+# Built once at import; validate_json parses and validates model output in a single pass
+TOOLKIT_ADAPTER = TypeAdapter(Toolkit)
+TOOLKIT_BATCH_ADAPTER = TypeAdapter(ToolkitBatch)
+
+# Strict JSON schemas for OpenAI structured outputs, so the model is constrained to
+# the exact shape the adapters above validate
+RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "why_it_helps": {"type": "string"},
+        "steps": {"type": "array", "items": {"type": "string"}},
+        "time_estimate": {"type": "string"},
+        "difficulty": {"type": "string"},
+    },
+    "required": ["title", "why_it_helps", "steps", "time_estimate", "difficulty"],
+    "additionalProperties": False,
+}
+
+TOOLKIT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommendations": {"type": "array", "items": RECOMMENDATION_SCHEMA},
+    },
+    "required": ["recommendations"],
+    "additionalProperties": False,
+}
+
+TOOLKIT_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {"type": "array", "items": TOOLKIT_SCHEMA},
+    },
+    "required": ["results"],
+    "additionalProperties": False,
+}
+
+TOOLKIT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "toolkit", "schema": TOOLKIT_SCHEMA, "strict": True},
+}
+
+TOOLKIT_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "toolkit_batch", "schema": TOOLKIT_BATCH_SCHEMA, "strict": True},
+}
@@ -2,9 +2,13 @@
 User memory module - processes user profile, action history, and feedback data.
 Note: Data is stored in Firestore via frontend, this module processes it for prompts.
 """
+import functools
 import logging
+from collections import Counter
 from typing import Dict, Any, List, Optional
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,6 +20,9 @@ def format_user_memory_for_prompt(
     """
     Format user memory data into a string for the agent prompt.
     
+    The same profile is sent with every request in a session, so results are
+    memoized on a serialized snapshot of the inputs.
+    
     Args:
         user_profile: User profile with preferences, likes, dislikes, constraints
         recent_actions: List of recent actions (last 7)
@@ -24,6 +31,25 @@ def format_user_memory_for_prompt(
     Returns:
         Formatted string to include in prompt
     """
+    try:
+        key = orjson.dumps((user_profile, recent_actions, action_stats))
+    except TypeError:
+        # Not JSON-serializable (shouldn't happen for request bodies) - skip the cache
+        return _format_user_memory(user_profile, recent_actions, action_stats)
+    return _format_user_memory_cached(key)
+
+
+@functools.lru_cache(maxsize=256)
+def _format_user_memory_cached(key: bytes) -> str:
+    # Rebuild private copies from the key so cached output can't drift from the inputs
+    return _format_user_memory(*orjson.loads(key))
+
+
+def _format_user_memory(
+    user_profile: Optional[Dict[str, Any]],
+    recent_actions: Optional[List[Dict[str, Any]]],
+    action_stats: Optional[Dict[str, Any]],
+) -> str:
     memory_parts = []
     
     # User profile (preferences, constraints)
@@ -34,24 +60,16 @@ def format_user_memory_for_prompt(
         constraints = user_profile.get('constraints', [])
         
         if preferences:
-            memory_parts.append("User preferences:")
-            for pref in preferences:
-                memory_parts.append(f"  - {pref}")
+            memory_parts.append("User preferences:\n" + "\n".join(f"  - {pref}" for pref in preferences))
         
         if likes:
-            memory_parts.append("User likes:")
-            for like in likes:
-                memory_parts.append(f"  - {like}")
+            memory_parts.append("User likes:\n" + "\n".join(f"  - {like}" for like in likes))
         
         if dislikes:
-            memory_parts.append("User dislikes:")
-            for dislike in dislikes:
-                memory_parts.append(f"  - {dislike}")
+            memory_parts.append("User dislikes:\n" + "\n".join(f"  - {dislike}" for dislike in dislikes))
         
         if constraints:
-            memory_parts.append("User constraints:")
-            for constraint in constraints:
-                memory_parts.append(f"  - {constraint}")
+            memory_parts.append("User constraints:\n" + "\n".join(f"  - {constraint}" for constraint in constraints))
     
     # Last 3 suggestions (most recent) - detailed format for natural referencing
     if recent_actions and len(recent_actions) > 0:
@@ -89,17 +107,14 @@ def format_user_memory_for_prompt(
         
         # Also include summary of all recent actions for pattern recognition
         if len(recent_actions) > 3:
-            action_summary = {}
-            for action in recent_actions:
-                action_type = action.get('actionType', 'unknown')
-                outcome = action.get('outcome', 'unknown')
-                # Count actions by type and outcome
-                key = f"{action_type}_{outcome}"
-                action_summary[key] = action_summary.get(key, 0) + 1
+            # Count actions by type and outcome
+            action_summary = Counter(
+                (action.get('actionType', 'unknown'), action.get('outcome', 'unknown'))
+                for action in recent_actions
+            )
             
             memory_parts.append(f"\nPattern from last {len(recent_actions)} actions:")
-            for key, count in action_summary.items():
-                action_type, outcome = key.rsplit('_', 1)
+            for (action_type, outcome), count in action_summary.items():
                 action_name = action_type.replace('_', ' ').title()
                 if outcome == 'confirmed':
                     memory_parts.append(f"  - {count} {action_name} (accepted)")
@@ -112,15 +127,13 @@ def format_user_memory_for_prompt(
         average_ratings = action_stats.get('average_ratings', {})
         
         if preferences:
-            memory_parts.append("\nUser behavior patterns:")
-            for pref in preferences:
-                memory_parts.append(f"  - {pref}")
+            memory_parts.append("\nUser behavior patterns:\n" + "\n".join(f"  - {pref}" for pref in preferences))
         
         if average_ratings:
-            memory_parts.append("\nAverage ratings by action type:")
-            for action_type, avg_rating in average_ratings.items():
-                action_name = action_type.replace('_', ' ').title()
-                memory_parts.append(f"  - {action_name}: {avg_rating:.1f}/5")
+            memory_parts.append("\nAverage ratings by action type:\n" + "\n".join(
+                f"  - {action_type.replace('_', ' ').title()}: {avg_rating:.1f}/5"
+                for action_type, avg_rating in average_ratings.items()
+            ))
     
     return "\n".join(memory_parts) if memory_parts else ""
 
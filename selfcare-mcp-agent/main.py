@@ -1,4 +1,8 @@
 import asyncio
+import os
+import sys
+import threading
+from typing import List, Optional
 from agents import Agent, Runner, gen_trace_id, trace
 from agents.mcp import MCPServerStdio, MCPServer
 from openai.types.responses import ResponseTextDeltaEvent
@@ -7,6 +11,48 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+class StdinLines:
+    """Lines typed on stdin, read by a daemon thread and handed to the event loop.
+
+    The thread reads the raw file descriptor: a daemon thread blocked in input()
+    holds the buffered stdin lock, which aborts the interpreter at exit, and
+    asyncio.to_thread would make asyncio.run() wait on it, so Ctrl-C would hang.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self) -> None:
+        buffered = b""
+        while True:
+            try:
+                chunk = os.read(sys.stdin.fileno(), 4096)
+            except OSError:
+                chunk = b""
+            buffered += chunk
+            *complete, buffered = buffered.split(b"\n")
+            lines: List[Optional[str]] = [line.decode(errors="replace") for line in complete]
+            if not chunk:
+                # EOF: flush an unterminated last line, then signal the end
+                if buffered:
+                    lines.append(buffered.decode(errors="replace"))
+                lines.append(None)
+            for line in lines:
+                try:
+                    self._loop.call_soon_threadsafe(self._queue.put_nowait, line)
+                except RuntimeError:
+                    return  # The loop already closed
+            if not chunk:
+                return
+
+    async def readline(self, prompt: str) -> Optional[str]:
+        """Return the next line, or None once stdin is closed."""
+        print(prompt, end="", flush=True)
+        return await self._queue.get()
+
+
 async def main():
     async with MCPServerStdio(
         name="Self-Care MCP Server",
@@ -32,12 +78,18 @@ async def run(mcp_server: MCPServer):
     )
 
     input_items = []
+    stdin_lines = StdinLines()
 
     print("=== Self-Care Agent ===")
     print("Type 'exit' to end the conversation")
 
     while True:
-        user_input = input("\nUser: ").strip()
+        # Read stdin off the event loop so MCP/stream tasks keep running while we wait
+        line = await stdin_lines.readline("\nUser: ")
+        if line is None:
+            print("\nTake care! 👋")
+            break
+        user_input = line.strip()
         input_items.append({"content": user_input, "role": "user"})
 
         if user_input.lower() in ["exit", "quit", "bye"]:
@@ -73,4 +125,7 @@ async def run(mcp_server: MCPServer):
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nTake care! 👋")
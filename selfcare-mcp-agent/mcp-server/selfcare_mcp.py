@@ -1,15 +1,35 @@
-import json
+import asyncio
+import functools
+import hmac
+import logging
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-import urllib.request
-import urllib.parse
+from typing import Callable, List, Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import httpx
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
+from mcp.server.transport_security import TransportSecuritySettings
 from openai import OpenAI
+from pydantic import BaseModel, ValidationError
+
+# stdout carries the stdio MCP protocol, so diagnostics go to stderr
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+logger = logging.getLogger("selfcare_mcp")
+
+# orjson is much faster for tool payloads; fall back to the stdlib if it is missing
+try:
+    import orjson
+except ImportError:
+    import json
+    orjson = None
 
 # Google Calendar imports
 try:
@@ -21,8 +41,7 @@ try:
     GOOGLE_CALENDAR_AVAILABLE = True
 except ImportError:
     GOOGLE_CALENDAR_AVAILABLE = False
-    import sys
-    print("WARNING: Google Calendar libraries not available. Calendar tools will not work.", file=sys.stderr)
+    logger.warning("Google Calendar libraries not available. Calendar tools will not work.")
 
 # Ensure we can import the project's prompt definitions
 try:
@@ -30,30 +49,91 @@ try:
     if str(PROJECT_ROOT) not in sys.path:
         sys.path.append(str(PROJECT_ROOT))
 
-    from backend.prompts import system_prompt as shared_system_prompt_text, user_prompt_template  # noqa: E402
+    from backend.prompts import CRISIS_TOOLKIT, SYSTEM_PROMPT, is_crisis_input, render_toolkit_prompt  # noqa: E402
+    from backend.toolkit_schema import (  # noqa: E402
+        TOOLKIT_ADAPTER,
+        TOOLKIT_BATCH_ADAPTER,
+        TOOLKIT_BATCH_RESPONSE_FORMAT,
+        TOOLKIT_RESPONSE_FORMAT,
+    )
 except ImportError as e:
-    import sys
-    print(f"ERROR: Failed to import backend.prompts: {e}", file=sys.stderr)
-    print(f"PROJECT_ROOT: {PROJECT_ROOT if 'PROJECT_ROOT' in locals() else 'NOT SET'}", file=sys.stderr)
-    print(f"sys.path: {sys.path}", file=sys.stderr)
+    logger.error(
+        "Failed to import backend prompt/schema modules: %s (PROJECT_ROOT: %s, sys.path: %s)",
+        e, PROJECT_ROOT if 'PROJECT_ROOT' in locals() else 'NOT SET', sys.path,
+    )
     raise
 
-# Load .env from project root, backend, or current directory
-load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
-load_dotenv(dotenv_path=PROJECT_ROOT / "backend" / ".env")
-load_dotenv()  # Also try current directory
+# Load .env from project root, backend, or current directory - stop once the API key is found
+for dotenv_path in (PROJECT_ROOT / ".env", PROJECT_ROOT / "backend" / ".env", Path.cwd() / ".env"):
+    if dotenv_path.exists():
+        load_dotenv(dotenv_path=dotenv_path)
+        if os.getenv("OPENAI_API_KEY"):
+            break
 
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
-    import sys
-    print("ERROR: OPENAI_API_KEY is not set.", file=sys.stderr)
-    print(f"Checked .env files in: {PROJECT_ROOT / '.env'}, {PROJECT_ROOT / 'backend' / '.env'}, current directory", file=sys.stderr)
+    logger.error(
+        "OPENAI_API_KEY is not set. Checked .env files in: %s, %s, current directory",
+        PROJECT_ROOT / '.env', PROJECT_ROOT / 'backend' / '.env',
+    )
     raise RuntimeError("OPENAI_API_KEY is not set. Please configure it in .env file in project root or backend directory.")
 
-# Use synchronous client - FastMCP tools should be synchronous
-client = OpenAI(api_key=api_key, timeout=90.0)  # 90 second timeout for API calls
+# Synchronous OpenAI client: the toolkit tools call it from worker threads (_offload).
+# One long-lived HTTP/2 connection pool so repeated calls skip TCP/TLS setup.
+http_client = httpx.Client(
+    http2=True,
+    # Sized for concurrent tool calls now that tool bodies run on worker threads
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=300.0),
+    timeout=httpx.Timeout(90.0, connect=10.0),
+)
+client = OpenAI(api_key=api_key, http_client=http_client, timeout=90.0)  # 90 second timeout for API calls
 mcp = FastMCP("selfcare-mcp")  # FastMCP doesn't support invocation_timeout parameter
 
+
+# Tool results are read by the model, not people; indent them only when debugging
+_PRETTY_JSON = os.getenv("MCP_PRETTY_JSON") == "1"
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize a tool result with orjson; MCP text content must be a str."""
+    if orjson is None:
+        # Match orjson's output: UTF-8 text, compact separators unless indenting
+        if _PRETTY_JSON:
+            return json.dumps(obj, indent=2, ensure_ascii=False)
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if _PRETTY_JSON else 0).decode()
+
+
+def _loads(data: bytes) -> Any:
+    return json.loads(data) if orjson is None else orjson.loads(data)
+
+
+# httplib2 (used by the Google API clients) is not thread-safe and the built
+# services are shared, so Google-bound tool bodies run one at a time
+_google_lock = threading.Lock()
+
+
+def _offload(lock: Optional[threading.Lock] = None):
+    """Run a blocking tool body on a worker thread.
+
+    FastMCP calls synchronous tools directly on its event loop, so one slow OpenAI
+    or Google call would stall every other request to the server. The wrapped
+    function keeps its signature for FastMCP and stays reachable via __wrapped__.
+    """
+    def decorator(fn):
+        def call(*args, **kwargs):
+            if lock is None:
+                return fn(*args, **kwargs)
+            with lock:
+                return fn(*args, **kwargs)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.to_thread(call, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 # Google Calendar and Docs setup
 SCOPES = [
     'https://www.googleapis.com/auth/calendar',
@@ -63,29 +143,91 @@ SCOPES = [
 CREDENTIALS_FILE = PROJECT_ROOT / "credentials.json"
 TOKEN_FILE = PROJECT_ROOT / "token.json"
 
+# Credentials and built API clients are reused across tool calls instead of
+# re-reading token.json and rebuilding the discovery-backed service every time
+_creds_cache: Optional["Credentials"] = None
+_service_cache: Dict[str, Any] = {}
 
-def get_google_credentials():
-    """Get authenticated Google credentials for Calendar and Docs."""
+# Tokens this close to expiry are refreshed on a background thread while the
+# current (still valid) token keeps serving requests. google-auth already marks
+# a token invalid a few minutes before expiry, so the margin must be well beyond
+# that or sparse traffic would rarely land in the window and refresh inline.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=15)
+_refresh_lock = threading.Lock()
+
+
+def _save_token(creds) -> None:
+    """Write token.json atomically so a concurrent reader never sees a partial file."""
+    tmp_path = TOKEN_FILE.with_suffix(".json.tmp")
+    with open(tmp_path, 'w') as token:
+        token.write(creds.to_json())
+    os.replace(tmp_path, TOKEN_FILE)
+
+
+def _bg_refresh(creds) -> None:
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        creds.refresh(Request())
+        _save_token(creds)
+    except Exception as e:
+        logger.warning("Background token refresh failed: %s", e)
+    finally:
+        _refresh_lock.release()
+
+
+def _schedule_refresh_if_expiring(creds) -> None:
+    if creds.expiry is None or not creds.refresh_token or _refresh_lock.locked():
+        return
+    # google-auth keeps expiry as a naive UTC datetime
+    remaining = creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)
+    if timedelta(0) < remaining < TOKEN_REFRESH_MARGIN:
+        threading.Thread(target=_bg_refresh, args=(creds,), daemon=True).start()
+
+
+def get_google_credentials(interactive: bool = True):
+    """Get authenticated Google credentials for Calendar and Docs.
+
+    With interactive=False, raise instead of starting the browser OAuth flow when
+    the saved token cannot be used or refreshed.
+    """
+    global _creds_cache
     if not GOOGLE_CALENDAR_AVAILABLE:
         raise RuntimeError("Google API libraries not installed")
-    
+
+    if _creds_cache is not None:
+        if _creds_cache.valid:
+            _schedule_refresh_if_expiring(_creds_cache)
+            return _creds_cache
+        if _creds_cache.refresh_token:
+            # Refresh in place so the services built on these credentials stay valid
+            with _refresh_lock:
+                if not _creds_cache.valid:
+                    _creds_cache.refresh(Request())
+                    _save_token(_creds_cache)
+            return _creds_cache
+
     creds = None
     # The file token.json stores the user's access and refresh tokens
     if TOKEN_FILE.exists():
         try:
             creds = Credentials.from_authorized_user_file(str(TOKEN_FILE), SCOPES)
         except ValueError as e:
+            if not interactive:
+                raise RuntimeError(f"token.json is invalid ({e}); sign-in required") from e
             # If token.json is corrupted or missing refresh_token, delete it and re-authenticate
-            import sys
-            print(f"WARNING: token.json is invalid ({e}). Deleting and re-authenticating...", file=sys.stderr)
+            logger.warning("token.json is invalid (%s). Deleting and re-authenticating...", e)
             TOKEN_FILE.unlink()
             creds = None
     
     # If there are no (valid) credentials available, let the user log in
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            with _refresh_lock:
+                creds.refresh(Request())
         else:
+            if not interactive:
+                raise RuntimeError("Google sign-in required; saved token is missing or cannot be refreshed")
             if not CREDENTIALS_FILE.exists():
                 raise RuntimeError(
                     f"Google API credentials not found. Please download credentials.json from "
@@ -99,10 +241,9 @@ def get_google_credentials():
             # Use a fixed port (8080) for web application OAuth clients
             # This requires adding http://localhost:8080/ to authorized redirect URIs
             # Note: The trailing slash is important - Google requires exact match
-            import sys
-            print("Starting OAuth flow on port 8080...", file=sys.stderr)
-            print("Make sure http://localhost:8080/ is in your authorized redirect URIs", file=sys.stderr)
-            print("Requesting offline access to get refresh token...", file=sys.stderr)
+            logger.info("Starting OAuth flow on port 8080...")
+            logger.info("Make sure http://localhost:8080/ is in your authorized redirect URIs")
+            logger.info("Requesting offline access to get refresh token...")
             creds = flow.run_local_server(
                 port=8080, 
                 open_browser=True,
@@ -111,105 +252,253 @@ def get_google_credentials():
             )
         
         # Save the credentials for the next run
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
-    
+        _save_token(creds)
+
+    if creds is not _creds_cache:
+        # Services built against the previous credentials object must be rebuilt
+        _service_cache.clear()
+        _creds_cache = creds
     return creds
 
 
+def _get_service(api: str, version: str):
+    """Return a cached Google API service, building it on first use or after re-authentication."""
+    service = _service_cache.get(api)
+    if service is not None and _creds_cache is not None and _creds_cache.valid:
+        _schedule_refresh_if_expiring(_creds_cache)
+    else:
+        creds = get_google_credentials()
+        service = _service_cache.get(api)
+        if service is None:
+            # build() gives each service its own authorized keep-alive connection
+            # (googleapiclient's build_http defaults), which the cache then reuses
+            service = build(api, version, credentials=creds, cache_discovery=False)
+            _service_cache[api] = service
+    return service
+
+
 def get_calendar_service():
     """Get authenticated Google Calendar service."""
-    creds = get_google_credentials()
-    return build('calendar', 'v3', credentials=creds)
+    return _get_service('calendar', 'v3')
 
 
 def get_docs_service():
     """Get authenticated Google Docs service."""
-    creds = get_google_credentials()
-    return build('docs', 'v1', credentials=creds)
+    return _get_service('docs', 'v1')
 
 
 def get_drive_service():
     """Get authenticated Google Drive service."""
-    creds = get_google_credentials()
-    return build('drive', 'v3', credentials=creds)
+    return _get_service('drive', 'v3')
+
+
+def get_docs_and_drive_services():
+    """Get the Docs and Drive services, building any that are missing concurrently."""
+    # Resolve credentials once up front so the two builds don't race to load them
+    get_google_credentials()
+    if 'docs' in _service_cache and 'drive' in _service_cache:
+        return _service_cache['docs'], _service_cache['drive']
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        docs_future = executor.submit(get_docs_service)
+        drive_future = executor.submit(get_drive_service)
+        return docs_future.result(), drive_future.result()
 
 
 @mcp.prompt()
 def system_prompt() -> str:
     """Expose the same coaching instructions used by the FastAPI backend."""
-    return shared_system_prompt_text.strip()
+    return SYSTEM_PROMPT
 
 
-@mcp.tool()  # FastMCP tool decorator - must be synchronous
+@mcp.tool()
+@_offload()
 def generate_toolkit(
     struggle: str,
     mood: str,
     focus: str,
     coping_preferences: Optional[List[str]] = None,
     energy_level: str = "medium",
+    prewarm_google: bool = False,
 ) -> str:
-    """Generate a personalized self-care toolkit using the shared prompt template."""
-
-    prompt = user_prompt_template.format(
-        struggle=struggle,
-        mood=mood,
-        focus=focus,
-        coping_preferences=", ".join(coping_preferences or []),
-        energy_level=energy_level,
-    )
+    """Generate a personalized self-care toolkit using the shared prompt template.
+
+    Set prewarm_google when a journal entry will be created next; the Docs and
+    Drive services are then built in the background while the model runs.
+    """
+
+    if is_crisis_input(struggle, mood, focus):
+        logger.warning("Crisis keywords detected; returning crisis resources without calling OpenAI")
+        return _dumps(CRISIS_TOOLKIT)
+
+    if prewarm_google:
+        _prewarm_executor.submit(_prewarm_google_services)
+
+    prompt = _render_toolkit_prompt(struggle, mood, focus, coping_preferences, energy_level)
+    output = _complete_json(SYSTEM_PROMPT, prompt, TOOLKIT_RESPONSE_FORMAT)
+    toolkit = _validate_toolkit(output, TOOLKIT_ADAPTER)
+
+    if not toolkit.recommendations:
+        logger.error("No recommendations found in response: %s", output[:500])
+        raise ValueError("No recommendations returned from the model")
+
+    return _toolkit_items_json(toolkit)
+
 
-    # Use synchronous client for API call
+# Background work that overlaps Google setup with an in-flight OpenAI completion
+_prewarm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="google-prewarm")
+
+
+def _prewarm_google_services() -> None:
+    # Never start the interactive OAuth flow from a background thread: only warm up
+    # when the saved token is valid or refreshable
+    if not GOOGLE_CALENDAR_AVAILABLE or not TOKEN_FILE.exists():
+        return
+    try:
+        with _google_lock:
+            get_google_credentials(interactive=False)
+            get_docs_and_drive_services()
+    except Exception as e:
+        logger.warning("Google service prewarm failed: %s", e)
+
+
+# Appended to the system prompt when several toolkit requests share one completion
+BATCH_INSTRUCTIONS = """
+You will receive several numbered toolkit requests in one message. Answer each one independently.
+Return a JSON object {"results": [{"recommendations": [...]}, ...]} with exactly one entry per request, in the same order as the requests.
+"""
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n" + BATCH_INSTRUCTIONS
+
+
+# Upper bound on toolkits per batch call, keeping the single completion well inside
+# the model's output limit
+MAX_TOOLKIT_BATCH = 8
+
+
+class ToolkitInput(BaseModel):
+    """One set of generate_toolkit arguments inside a batch."""
+
+    struggle: str
+    mood: str
+    focus: str
+    coping_preferences: Optional[List[str]] = None
+    energy_level: str = "medium"
+    prewarm_google: bool = False
+
+
+@mcp.tool()
+@_offload()
+def generate_toolkit_batch(requests: List[ToolkitInput]) -> str:
+    """Generate toolkits for several inputs with a single OpenAI round-trip.
+
+    Each request takes generate_toolkit's arguments. Returns {"results": [...]}
+    holding one generate_toolkit-style toolkit per request, in the same order.
+    Crisis inputs are answered locally and never sent to the model.
+    """
+    if len(requests) > MAX_TOOLKIT_BATCH:
+        raise ValueError(f"At most {MAX_TOOLKIT_BATCH} toolkit requests per batch, got {len(requests)}")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+    pending: List[int] = []
+    for index, request in enumerate(requests):
+        if is_crisis_input(request.struggle, request.mood, request.focus):
+            results[index] = CRISIS_TOOLKIT
+        else:
+            pending.append(index)
+
+    if len(pending) == 1:
+        # A lone request needs no batch prompt; call the synchronous tool body directly
+        results[pending[0]] = _loads(generate_toolkit.__wrapped__(**requests[pending[0]].model_dump()))
+    elif pending:
+        if any(requests[index].prewarm_google for index in pending):
+            _prewarm_executor.submit(_prewarm_google_services)
+        prompt = "\n\n".join(
+            f"Request {number}:\n"
+            + _render_toolkit_prompt(
+                request.struggle, request.mood, request.focus, request.coping_preferences, request.energy_level
+            )
+            for number, request in enumerate((requests[index] for index in pending), start=1)
+        )
+        output = _complete_json(BATCH_SYSTEM_PROMPT, prompt, TOOLKIT_BATCH_RESPONSE_FORMAT)
+        batch = _validate_toolkit(output, TOOLKIT_BATCH_ADAPTER)
+        if len(batch.results) != len(pending):
+            raise ValueError(f"Expected {len(pending)} toolkits from the model, got {len(batch.results)}")
+        for index, toolkit in zip(pending, batch.results):
+            if not toolkit.recommendations:
+                raise ValueError("No recommendations returned from the model")
+            results[index] = {"items": [r.model_dump() for r in toolkit.recommendations]}
+
+    return _dumps({"results": results})
+
+
+def _render_toolkit_prompt(
+    struggle: str,
+    mood: str,
+    focus: str,
+    coping_preferences: Optional[List[str]] = None,
+    energy_level: str = "medium",
+) -> str:
+    return render_toolkit_prompt(struggle, mood, focus, ", ".join(coping_preferences or []), energy_level)
+
+
+def _complete_json(system_content: str, user_content: str, response_format: Dict[str, Any]) -> str:
+    """Run a structured-output chat completion and return the raw output text."""
+    # Use synchronous client for API call; stream it so tokens are consumed as they
+    # are generated and parsing starts the moment the stream closes
     try:
-        response = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model="gpt-5-nano",
             messages=[
-                {"role": "system", "content": shared_system_prompt_text},
-                {"role": "user", "content": prompt},
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": user_content},
             ],
-            response_format={"type": "json_object"},
+            response_format=response_format,
+            stream=True,
         )
-    except Exception as e:
-        import sys
-        print(f"ERROR in OpenAI API call: {e}", file=sys.stderr)
+        parts: List[str] = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+    except Exception:
+        logger.exception("OpenAI API call failed")
         raise
 
-    output = response.choices[0].message.content or "{}"
+    return "".join(parts) or "{}"
 
+
+def _validate_toolkit(output: str, adapter):
     try:
-        parsed_output = json.loads(output)
-    except json.JSONDecodeError as exc:
-        import sys
-        print(f"ERROR: Invalid JSON from OpenAI: {exc}", file=sys.stderr)
-        print(f"Raw output: {output[:500]}", file=sys.stderr)
+        return adapter.validate_json(output)
+    except ValidationError as exc:
+        logger.error("Invalid toolkit JSON from OpenAI: %s\nRaw output: %s", exc, output[:500])
         raise ValueError(f"Invalid JSON response from OpenAI: {exc}") from exc
 
-    # Extract recommendations - look for "recommendations" key specifically
-    recommendations: list = []
-    if isinstance(parsed_output, list):
-        recommendations = parsed_output
-    elif isinstance(parsed_output, dict):
-        # First try the "recommendations" key (as specified in the prompt)
-        if "recommendations" in parsed_output and isinstance(parsed_output["recommendations"], list):
-            recommendations = parsed_output["recommendations"]
-        else:
-            # Fallback: look for any list value
-            for key, value in parsed_output.items():
-                if isinstance(value, list) and value:
-                    recommendations = value
-                    break
-
-    if not recommendations:
-        import sys
-        print(f"ERROR: No recommendations found in response", file=sys.stderr)
-        print(f"Parsed output keys: {list(parsed_output.keys()) if isinstance(parsed_output, dict) else 'N/A'}", file=sys.stderr)
-        print(f"Parsed output: {str(parsed_output)[:500]}", file=sys.stderr)
-        raise ValueError("No recommendations returned from the model")
 
-    return json.dumps({"items": recommendations}, indent=2)
+def _toolkit_items_json(toolkit) -> str:
+    return _dumps({"items": [r.model_dump() for r in toolkit.recommendations]})
+
+
+# Python 3.11+ parses a trailing "Z" natively; older versions need it rewritten as an offset
+if sys.version_info >= (3, 11):
+    _ISO_PARSE = datetime.fromisoformat
+else:
+    def _ISO_PARSE(value: str) -> datetime:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+# Partial response for free/busy scans: event boundaries plus the paging cursor
+EVENT_TIME_FIELDS = 'items(start/dateTime,start/date,end/dateTime,end/date),nextPageToken'
+
+
+def _parse_event_time(boundary: Dict[str, str], tzinfo) -> datetime:
+    """Parse a Calendar event start/end; all-day dates are pinned to the given timezone."""
+    date_time = boundary.get('dateTime')
+    if date_time is not None:
+        return _ISO_PARSE(date_time)
+    return datetime.fromisoformat(boundary['date']).replace(tzinfo=tzinfo)
 
 
 @mcp.tool()
+@_offload(_google_lock)
 def calendar_get_free_slots(
     start_date: str,
     end_date: str,
@@ -227,7 +516,7 @@ def calendar_get_free_slots(
         JSON string with free slots: {"free_slots": [{"start": "ISO datetime", "end": "ISO datetime"}, ...]}
     """
     if not GOOGLE_CALENDAR_AVAILABLE:
-        return json.dumps({"error": "Google Calendar not available", "free_slots": []})
+        return _dumps({"error": "Google Calendar not available", "free_slots": []})
     
     try:
         service = get_calendar_service()
@@ -239,7 +528,7 @@ def calendar_get_free_slots(
         elif start_date.lower() == "tomorrow":
             start_dt = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
         else:
-            start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+            start_dt = _ISO_PARSE(start_date)
             if start_dt.tzinfo is None:
                 start_dt = start_dt.replace(tzinfo=now.tzinfo)
         
@@ -248,41 +537,37 @@ def calendar_get_free_slots(
         elif end_date.lower() == "tomorrow":
             end_dt = (now + timedelta(days=1)).replace(hour=23, minute=59, second=59, microsecond=0)
         else:
-            end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+            end_dt = _ISO_PARSE(end_date)
             if end_dt.tzinfo is None:
                 end_dt = end_dt.replace(tzinfo=now.tzinfo)
         
-        # Get calendar events
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=start_dt.isoformat(),
-            timeMax=end_dt.isoformat(),
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
+        # Get calendar events; only start/end are read, so request just those fields
+        events = []
+        page_token = None
+        while True:
+            events_result = service.events().list(
+                calendarId='primary',
+                timeMin=start_dt.isoformat(),
+                timeMax=end_dt.isoformat(),
+                singleEvents=True,
+                orderBy='startTime',
+                fields=EVENT_TIME_FIELDS,
+                maxResults=2500,
+                pageToken=page_token
+            ).execute()
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
         
         # Find free slots
         free_slots = []
         current_time = start_dt
         
+        local_tz = now.tzinfo
         for event in events:
-            event_start_str = event['start'].get('dateTime', event['start'].get('date'))
-            event_end_str = event['end'].get('dateTime', event['end'].get('date'))
-            
-            # Parse event times
-            if 'T' in event_start_str:
-                event_start = datetime.fromisoformat(event_start_str.replace('Z', '+00:00'))
-            else:
-                event_start = datetime.fromisoformat(event_start_str)
-                event_start = event_start.replace(tzinfo=now.tzinfo)
-            
-            if 'T' in event_end_str:
-                event_end = datetime.fromisoformat(event_end_str.replace('Z', '+00:00'))
-            else:
-                event_end = datetime.fromisoformat(event_end_str)
-                event_end = event_end.replace(tzinfo=now.tzinfo)
+            event_start = _parse_event_time(event['start'], local_tz)
+            event_end = _parse_event_time(event['end'], local_tz)
             
             # Check if there's a gap before this event
             if current_time < event_start:
@@ -308,16 +593,128 @@ def calendar_get_free_slots(
                     "duration_minutes": int(gap_duration)
                 })
         
-        return json.dumps({"free_slots": free_slots}, indent=2)
+        return _dumps({"free_slots": free_slots})
     
     except Exception as e:
-        import sys
         error_msg = f"Error getting free slots: {str(e)}"
-        print(f"ERROR: {error_msg}", file=sys.stderr)
-        return json.dumps({"error": error_msg, "free_slots": []})
+        logger.exception("Calendar free-slot lookup failed")
+        return _dumps({"error": error_msg, "free_slots": []})
+
+
+def _detect_iana_tz() -> str:
+    """Best-effort IANA name for the machine's timezone, for Google Calendar event times.
+
+    Only region keys like "America/New_York" are accepted; legacy names such as
+    "EST" or "MST" resolve to fixed offsets with no DST.
+    """
+    tz_env = os.getenv('TZ', '').lstrip(':')
+    candidates = []
+    if tz_env:
+        candidates.append(tz_env)
+    else:
+        # TZ overrides the system setting, so only consult the system files without it
+        try:
+            # e.g. /usr/share/zoneinfo/America/New_York
+            target = os.readlink('/etc/localtime')
+            if 'zoneinfo/' in target:
+                candidates.append(target.split('zoneinfo/', 1)[1])
+        except OSError:
+            pass
+        try:
+            candidates.append(Path('/etc/timezone').read_text().strip())
+        except OSError:
+            pass
+    for tz_name in candidates:
+        if '/' not in tz_name:
+            continue
+        try:
+            return ZoneInfo(tz_name).key
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    # Map common timezone abbreviations to IANA names
+    tz_name = ' '.join(time.tzname)
+    if 'UTC' in tz_name or 'GMT' in tz_name:
+        return 'UTC'
+    elif 'EST' in tz_name or 'EDT' in tz_name:
+        return 'America/New_York'
+    elif 'PST' in tz_name or 'PDT' in tz_name:
+        return 'America/Los_Angeles'
+    elif 'CST' in tz_name or 'CDT' in tz_name:
+        return 'America/Chicago'
+    elif 'MST' in tz_name or 'MDT' in tz_name:
+        return 'America/Denver'
+    return 'America/New_York'  # Default
+
+
+# The machine's timezone doesn't change while the server runs
+_DEFAULT_TZ_STR = _detect_iana_tz()
+
+
+def _resolve_now(now: datetime) -> datetime:
+    """Start immediately, rounded up to the next 5-minute mark (at least 5 minutes from now)."""
+    start_dt = now.replace(second=0, microsecond=0)
+    rounded_minutes = ((start_dt.minute // 5) + 1) * 5
+    if rounded_minutes >= 60:
+        # Move to next hour
+        start_dt = (start_dt + timedelta(hours=1)).replace(minute=0)
+    else:
+        start_dt = start_dt.replace(minute=rounded_minutes)
+    if start_dt <= now:
+        start_dt = (now + timedelta(minutes=5)).replace(second=0, microsecond=0)
+    return start_dt
+
+
+def _in_hours(hours: int) -> Callable[[datetime], datetime]:
+    return lambda now: (now + timedelta(hours=hours)).replace(second=0, microsecond=0)
+
+
+def _next_at(hour: int) -> Callable[[datetime], datetime]:
+    """Today at the given hour, or tomorrow if that time has already passed."""
+    def resolve(now: datetime) -> datetime:
+        start_dt = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if start_dt <= now:
+            start_dt = (now + timedelta(days=1)).replace(hour=hour, minute=0, second=0, microsecond=0)
+        return start_dt
+    return resolve
+
+
+def _tomorrow_at(hour: int) -> Callable[[datetime], datetime]:
+    return lambda now: (now + timedelta(days=1)).replace(hour=hour, minute=0, second=0, microsecond=0)
+
+
+# User-friendly start times accepted by calendar_create_event
+_START_TIME_RESOLVERS: Dict[str, Callable[[datetime], datetime]] = {
+    "now": _resolve_now,
+    "in_1_hour": _in_hours(1),
+    "in_2_hours": _in_hours(2),
+    "today_morning": _next_at(9),
+    "today_afternoon": _next_at(14),
+    "today_evening": _next_at(19),
+    "tomorrow_morning": _tomorrow_at(9),
+    "tomorrow_afternoon": _tomorrow_at(14),
+}
+
+
+def _parse_start_time(start_time: str, now: datetime) -> datetime:
+    """Parse an ISO or datetime-local start time, moving past times to the next day."""
+    try:
+        # Handle datetime-local format (YYYY-MM-DDTHH:MM)
+        if 'T' in start_time and len(start_time) == 16:
+            # Add seconds if missing
+            start_time = start_time + ':00'
+        start_dt = _ISO_PARSE(start_time)
+    except ValueError:
+        raise ValueError(f"Invalid start_time format: {start_time}. Supported formats: {', '.join(repr(k) for k in _START_TIME_RESOLVERS)}, or ISO datetime format.")
+    if start_dt.tzinfo is None:
+        start_dt = start_dt.replace(tzinfo=now.tzinfo)
+    # If parsed time is in the past, move to next day at same time
+    if start_dt < now:
+        start_dt = start_dt + timedelta(days=1)
+    return start_dt
 
 
 @mcp.tool()
+@_offload(_google_lock)
 def calendar_create_event(
     title: str,
     start_time: str,
@@ -337,78 +734,23 @@ def calendar_create_event(
         JSON string with event details: {"event_id": "...", "html_link": "...", "start": "...", "end": "..."}
     """
     if not GOOGLE_CALENDAR_AVAILABLE:
-        return json.dumps({"error": "Google Calendar not available"})
+        return _dumps({"error": "Google Calendar not available"})
     
     try:
         service = get_calendar_service()
         
         # Parse start time
         # Use datetime.now() with timezone awareness
-        from datetime import timezone
         now = datetime.now(timezone.utc) if datetime.now().tzinfo is None else datetime.now()
         # If still no timezone, use local timezone
         if now.tzinfo is None:
             # Get local timezone offset
-            import time
             offset_seconds = -time.timezone if time.daylight == 0 else -time.altzone
             now = now.replace(tzinfo=timezone(timedelta(seconds=offset_seconds)))
         
         # Handle user-friendly time formats
-        if start_time == "now":
-            # Start immediately (round to next 5 minutes, minimum 5 minutes from now)
-            start_dt = now.replace(second=0, microsecond=0)
-            minutes = start_dt.minute
-            # Round up to next 5-minute mark
-            rounded_minutes = ((minutes // 5) + 1) * 5
-            if rounded_minutes >= 60:
-                # Move to next hour
-                start_dt = (start_dt + timedelta(hours=1)).replace(minute=0)
-            else:
-                start_dt = start_dt.replace(minute=rounded_minutes)
-            # Ensure it's at least 5 minutes from now
-            if start_dt <= now:
-                start_dt = now + timedelta(minutes=5)
-                start_dt = start_dt.replace(second=0, microsecond=0)
-        elif start_time == "in_1_hour":
-            start_dt = now + timedelta(hours=1)
-            start_dt = start_dt.replace(second=0, microsecond=0)
-        elif start_time == "in_2_hours":
-            start_dt = now + timedelta(hours=2)
-            start_dt = start_dt.replace(second=0, microsecond=0)
-        elif start_time == "today_morning":
-            start_dt = now.replace(hour=9, minute=0, second=0, microsecond=0)
-            # If 9 AM has already passed today, move to tomorrow
-            if start_dt <= now:
-                start_dt = (now + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-        elif start_time == "today_afternoon":
-            start_dt = now.replace(hour=14, minute=0, second=0, microsecond=0)
-            # If 2 PM has already passed today, move to tomorrow afternoon
-            if start_dt <= now:
-                start_dt = (now + timedelta(days=1)).replace(hour=14, minute=0, second=0, microsecond=0)
-        elif start_time == "today_evening":
-            start_dt = now.replace(hour=19, minute=0, second=0, microsecond=0)
-            # If 7 PM has already passed today, move to tomorrow evening
-            if start_dt <= now:
-                start_dt = (now + timedelta(days=1)).replace(hour=19, minute=0, second=0, microsecond=0)
-        elif start_time == "tomorrow_morning":
-            start_dt = (now + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-        elif start_time == "tomorrow_afternoon":
-            start_dt = (now + timedelta(days=1)).replace(hour=14, minute=0, second=0, microsecond=0)
-        else:
-            # Try to parse as ISO format or datetime-local format
-            try:
-                # Handle datetime-local format (YYYY-MM-DDTHH:MM)
-                if 'T' in start_time and len(start_time) == 16:
-                    # Add seconds if missing
-                    start_time = start_time + ':00'
-                start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                if start_dt.tzinfo is None:
-                    start_dt = start_dt.replace(tzinfo=now.tzinfo)
-                # If parsed time is in the past, move to next day at same time
-                if start_dt < now:
-                    start_dt = start_dt + timedelta(days=1)
-            except ValueError:
-                raise ValueError(f"Invalid start_time format: {start_time}. Supported formats: 'now', 'in_1_hour', 'in_2_hours', 'today_morning', 'today_afternoon', 'today_evening', 'tomorrow_morning', 'tomorrow_afternoon', or ISO datetime format.")
+        resolver = _START_TIME_RESOLVERS.get(start_time)
+        start_dt = resolver(now) if resolver else _parse_start_time(start_time, now)
         
         # Final safety check: ensure start_dt is in the future (at least 5 minutes from now)
         # Also ensure timezone is consistent
@@ -428,31 +770,8 @@ def calendar_create_event(
         if end_dt.tzinfo is None:
             end_dt = end_dt.replace(tzinfo=now.tzinfo)
         
-        # Get timezone string for Google Calendar
         # Google Calendar expects IANA timezone names like 'America/New_York'
-        tz_str = 'America/New_York'  # Default
-        if now.tzinfo:
-            # Try to get timezone name
-            tz_name = str(now.tzinfo)
-            # Map common timezone strings to IANA names
-            if 'UTC' in tz_name or 'GMT' in tz_name:
-                tz_str = 'UTC'
-            elif 'EST' in tz_name or 'EDT' in tz_name:
-                tz_str = 'America/New_York'
-            elif 'PST' in tz_name or 'PDT' in tz_name:
-                tz_str = 'America/Los_Angeles'
-            elif 'CST' in tz_name or 'CDT' in tz_name:
-                tz_str = 'America/Chicago'
-            else:
-                # Try to extract from tzinfo
-                try:
-                    # For timezone objects, try to get the zone name
-                    if hasattr(now.tzinfo, 'zone'):
-                        tz_str = now.tzinfo.zone
-                    elif hasattr(now.tzinfo, 'key'):
-                        tz_str = now.tzinfo.key
-                except:
-                    pass
+        tz_str = _DEFAULT_TZ_STR
         
         # Create event
         event = {
@@ -470,22 +789,29 @@ def calendar_create_event(
         
         event_result = service.events().insert(calendarId='primary', body=event).execute()
         
-        return json.dumps({
+        return _dumps({
             "event_id": event_result.get('id'),
             "html_link": event_result.get('htmlLink'),
             "start": event_result['start'].get('dateTime', event_result['start'].get('date')),
             "end": event_result['end'].get('dateTime', event_result['end'].get('date')),
             "title": event_result.get('summary', title)
-        }, indent=2)
+        })
     
     except Exception as e:
-        import sys
         error_msg = f"Error creating calendar event: {str(e)}"
-        print(f"ERROR: {error_msg}", file=sys.stderr)
-        return json.dumps({"error": error_msg})
+        logger.exception("Calendar event creation failed")
+        return _dumps({"error": error_msg})
+
+
+# Rule between journal prompts in a document
+_SEPARATOR = "─" * 50
+
+# Backslash and single quote must be escaped inside a quoted Drive query string
+_DRIVE_ESCAPE = str.maketrans({"\\": "\\\\", "'": "\\'"})
 
 
 @mcp.tool()
+@_offload(_google_lock)
 def docs_create_journal_entry(
     title: str,
     prompt_template: str,
@@ -503,26 +829,32 @@ def docs_create_journal_entry(
         JSON string with document details: {"document_id": "...", "document_url": "...", "title": "...", "appended": true/false}
     """
     if not GOOGLE_CALENDAR_AVAILABLE:
-        return json.dumps({"error": "Google API libraries not installed"})
+        return _dumps({"error": "Google API libraries not installed"})
     
     try:
-        docs_service = get_docs_service()
-        drive_service = get_drive_service()
+        docs_service, drive_service = get_docs_and_drive_services()
         
-        # Check if a document with this title already exists today
-        # Search for files with the exact title
-        now = datetime.now()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = now.replace(hour=23, minute=59, second=59, microsecond=999)
+        # Check if a document with this title already exists today; Drive filters
+        # on createdTime server-side, so at most the newest match comes back
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        tomorrow_start = today_start + timedelta(days=1)
+        # Drive compares RFC 3339 times in UTC
+        created_after = today_start.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        created_before = tomorrow_start.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        escaped_title = title.translate(_DRIVE_ESCAPE)
         
         # Search for documents with matching title
         try:
-            query = f"name='{title}' and mimeType='application/vnd.google-apps.document' and trashed=false"
+            query = (
+                f"name='{escaped_title}' and mimeType='application/vnd.google-apps.document' and trashed=false"
+                f" and createdTime >= '{created_after}' and createdTime < '{created_before}'"
+            )
             results = drive_service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name, createdTime)',
-                orderBy='createdTime desc'
+                orderBy='createdTime desc',
+                pageSize=1
             ).execute()
         except HttpError as e:
             if e.resp.status == 403 and 'accessNotConfigured' in str(e):
@@ -530,31 +862,15 @@ def docs_create_journal_entry(
                     "Google Drive API is not enabled. Please enable it at: "
                     "https://console.developers.google.com/apis/api/drive.googleapis.com/overview?project=1051858206996"
                 )
-                import sys
-                print(f"ERROR: {error_msg}", file=sys.stderr)
-                return json.dumps({"error": error_msg})
+                logger.error(error_msg)
+                return _dumps({"error": error_msg})
             else:
                 # For other errors, fall through to create new document
-                import sys
-                print(f"WARNING: Could not search for existing documents: {e}. Creating new document.", file=sys.stderr)
+                logger.warning("Could not search for existing documents: %s. Creating new document.", e)
                 results = {'files': []}
         
-        existing_doc = None
-        for file in results.get('files', []):
-            # Check if file was created today
-            # Google Drive API returns times in RFC 3339 format (ISO 8601)
-            created_time_str = file['createdTime']
-            # Parse the time (may have 'Z' for UTC or timezone offset)
-            if created_time_str.endswith('Z'):
-                created_time = datetime.fromisoformat(created_time_str.replace('Z', '+00:00'))
-            else:
-                created_time = datetime.fromisoformat(created_time_str)
-            
-            # Convert to local time for comparison (remove timezone for comparison)
-            created_local = created_time.replace(tzinfo=None)
-            if today_start <= created_local <= today_end:
-                existing_doc = file
-                break
+        files = results.get('files', [])
+        existing_doc = files[0] if files else None
         
         if existing_doc:
             # Append to existing document
@@ -565,62 +881,42 @@ def docs_create_journal_entry(
             end_index = doc.get('body', {}).get('content', [{}])[-1].get('endIndex', 1)
             
             # Prepare new content to append
-            new_content = "\n\n" + "─" * 50 + "\n\n"
+            new_content = "\n\n" + _SEPARATOR + "\n\n"
             if user_context:
                 new_content += f"Context: {user_context}\n\n"
             new_content += f"Journal Prompt:\n{prompt_template}\n\n"
-            new_content += "─" * 50 + "\n\n"
+            new_content += _SEPARATOR + "\n\n"
             new_content += "Your response:\n\n"
             
-            # Insert new content at the end
+            # Insert new content at the end, before the document's final newline
+            insert_index = end_index - 1
             requests = [
                 {
                     'insertText': {
                         'location': {
-                            'index': end_index - 1,  # Insert before the last newline
+                            'index': insert_index,
                         },
                         'text': new_content
                     }
                 }
             ]
             
-            # Find and format "Journal Prompt:" labels
-            # Get the full document text to find prompt positions
-            full_text = ""
-            for element in doc.get('body', {}).get('content', []):
-                if 'paragraph' in element:
-                    for para_elem in element['paragraph'].get('elements', []):
-                        if 'textRun' in para_elem:
-                            full_text += para_elem['textRun'].get('content', '')
-            
-            # Find all "Journal Prompt:" occurrences and format them
-            search_text = full_text + new_content
-            prompt_positions = []
-            search_pos = 0
-            while True:
-                pos = search_text.find('Journal Prompt:', search_pos)
-                if pos == -1:
-                    break
-                prompt_positions.append(pos)
-                search_pos = pos + 1
-            
-            # Format the new "Journal Prompt:" label
-            if prompt_positions:
-                # The new prompt is at the last position
-                new_prompt_start = len(full_text) + new_content.find('Journal Prompt:')
-                new_prompt_end = new_prompt_start + len('Journal Prompt:')
-                requests.append({
-                    'updateTextStyle': {
-                        'range': {
-                            'startIndex': new_prompt_start + 1,  # +1 because index is 1-based
-                            'endIndex': new_prompt_end + 1
-                        },
-                        'textStyle': {
-                            'bold': True
-                        },
-                        'fields': 'bold'
-                    }
-                })
+            # Format the new "Journal Prompt:" label; its document index follows
+            # directly from where new_content was inserted
+            new_prompt_start = insert_index + new_content.find('Journal Prompt:')
+            new_prompt_end = new_prompt_start + len('Journal Prompt:')
+            requests.append({
+                'updateTextStyle': {
+                    'range': {
+                        'startIndex': new_prompt_start,
+                        'endIndex': new_prompt_end
+                    },
+                    'textStyle': {
+                        'bold': True
+                    },
+                    'fields': 'bold'
+                }
+            })
             
             # Apply updates
             docs_service.documents().batchUpdate(
@@ -630,13 +926,13 @@ def docs_create_journal_entry(
             
             document_url = f"https://docs.google.com/document/d/{document_id}/edit"
             
-            return json.dumps({
+            return _dumps({
                 "document_id": document_id,
                 "document_url": document_url,
                 "title": title,
                 "appended": True,
                 "message": f"New prompt added to today's journal entry! You can continue writing at: {document_url}"
-            }, indent=2)
+            })
         else:
             # Create a new document
             document_content = f"{title}\n\n"
@@ -645,7 +941,7 @@ def docs_create_journal_entry(
                 document_content += f"Context: {user_context}\n\n"
             
             document_content += f"Journal Prompt:\n{prompt_template}\n\n"
-            document_content += "─" * 50 + "\n\n"
+            document_content += _SEPARATOR + "\n\n"
             document_content += "Your response:\n\n"
             
             # Create a new Google Doc
@@ -656,28 +952,23 @@ def docs_create_journal_entry(
             doc = docs_service.documents().create(body=document).execute()
             document_id = doc.get('documentId')
             
-            # Write content to the document
-            insert_request = {
-                'insertText': {
-                    'location': {
-                        'index': 1,
-                    },
-                    'text': document_content
+            # Insert the content and format it in one batchUpdate; Docs applies the
+            # requests in order, so the format ranges can be computed from
+            # document_content up front
+            requests = [
+                {
+                    'insertText': {
+                        'location': {
+                            'index': 1,
+                        },
+                        'text': document_content
+                    }
                 }
-            }
-            
-            # Execute insert first
-            docs_service.documents().batchUpdate(
-                documentId=document_id,
-                body={'requests': [insert_request]}
-            ).execute()
-            
-            # Then format the document
-            format_requests = []
+            ]
             
             # Format the title as a heading (first line)
             title_end = len(title) + 1  # +1 for newline
-            format_requests.append({
+            requests.append({
                 'updateParagraphStyle': {
                     'range': {
                         'startIndex': 1,
@@ -694,7 +985,7 @@ def docs_create_journal_entry(
             prompt_label_start = document_content.find('Journal Prompt:')
             if prompt_label_start > 0:
                 prompt_label_end = prompt_label_start + len('Journal Prompt:')
-                format_requests.append({
+                requests.append({
                     'updateTextStyle': {
                         'range': {
                             'startIndex': prompt_label_start + 1,  # +1 because index is 1-based after insert
@@ -707,33 +998,88 @@ def docs_create_journal_entry(
                     }
                 })
             
-            # Apply formatting
-            if format_requests:
-                docs_service.documents().batchUpdate(
-                    documentId=document_id,
-                    body={'requests': format_requests}
-                ).execute()
+            docs_service.documents().batchUpdate(
+                documentId=document_id,
+                body={'requests': requests}
+            ).execute()
             
             # Get the document URL
             document_url = f"https://docs.google.com/document/d/{document_id}/edit"
             
-            return json.dumps({
+            return _dumps({
                 "document_id": document_id,
                 "document_url": document_url,
                 "title": title,
                 "appended": False,
                 "message": f"Journal entry created! You can start writing at: {document_url}"
-            }, indent=2)
+            })
     
     except Exception as e:
-        import sys
         error_msg = f"Error creating journal entry: {str(e)}"
-        print(f"ERROR: {error_msg}", file=sys.stderr)
-        return json.dumps({"error": error_msg})
+        logger.exception("Journal entry creation failed")
+        return _dumps({"error": error_msg})
+
+
+# Open-Meteo is always the same host, so keep its connections alive across calls;
+# the transport retries once when a pooled connection fails to connect. The client
+# is async so a forecast awaits on the event loop instead of holding a worker thread
+_weather_http = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        retries=1,
+    ),
+    timeout=10.0,
+)
+
+# Fixed part of the Open-Meteo forecast query. Every value is ASCII-safe (commas
+# are legal in a query string), so it is written out literally with no encoding.
+_WEATHER_STATIC_QUERY = (
+    "current=temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m"
+    "&hourly=temperature_2m,precipitation_probability,weather_code"
+    "&daily=weather_code,temperature_2m_max,temperature_2m_min,precipitation_sum,precipitation_probability_max"
+    "&timezone=auto"
+)
+
+# Weather code interpretation (WMO codes)
+_WEATHER_CODES = {
+    0: "Clear sky",
+    1: "Partly cloudy", 2: "Partly cloudy", 3: "Partly cloudy",
+    45: "Foggy", 48: "Foggy",
+    51: "Drizzle", 53: "Drizzle", 55: "Drizzle",
+    56: "Freezing drizzle", 57: "Freezing drizzle",
+    61: "Rain", 63: "Rain", 65: "Rain",
+    66: "Freezing rain", 67: "Freezing rain",
+    71: "Snow", 73: "Snow", 75: "Snow",
+    77: "Snow grains",
+    80: "Rain showers", 81: "Rain showers", 82: "Rain showers",
+    85: "Snow showers", 86: "Snow showers",
+    95: "Thunderstorm",
+    96: "Thunderstorm with hail", 99: "Thunderstorm with hail",
+}
+
+# Code groups used to pick activity suggestions
+_NICE_CODES = frozenset({0, 1, 2})
+_RAIN_CODES = frozenset({61, 63, 65, 66, 67, 80, 81, 82})
+
+# Activity suggestions, built once and shared by every response
+_SUGGEST_NICE = ("Great weather for outdoor activities like walking, exercise, or spending time in nature",)
+_SUGGEST_RAINY = ("Rainy weather - consider indoor activities like journaling, reading, or meditation",)
+_SUGGEST_COLD = ("Cold weather - cozy indoor activities would be best",)
+_SUGGEST_HOT = ("Hot weather - stay hydrated and consider early morning or evening activities",)
+_DEFAULT_SUGGEST = ("Moderate weather conditions - good for both indoor and outdoor activities",)
+
+# Forecasts barely move within a few minutes; repeat lookups for the same spot
+# are served from memory (LRU, keyed on coordinates rounded to ~1 km). Only the
+# forecast is cached; each response echoes its own caller's location, so one
+# user's exact coordinates are never returned to another
+WEATHER_CACHE_TTL = 300.0
+_WEATHER_CACHE_MAX = 256
+_weather_cache: "OrderedDict[tuple, tuple[float, Dict[str, Any]]]" = OrderedDict()
+_weather_cache_lock = threading.Lock()
 
 
 @mcp.tool()
-def weather_get_forecast(
+async def weather_get_forecast(
     latitude: float,
     longitude: float,
     days: int = 1,
@@ -754,146 +1100,169 @@ def weather_get_forecast(
     """
     try:
         # Clamp days to valid range
-        days = max(1, min(7, days))
-        
-        # Build Open-Meteo API URL
-        base_url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "current": "temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m",
-            "hourly": "temperature_2m,precipitation_probability,weather_code",
-            "daily": "weather_code,temperature_2m_max,temperature_2m_min,precipitation_sum,precipitation_probability_max",
-            "timezone": "auto",
-            "forecast_days": days
-        }
-        
-        url = f"{base_url}?{urllib.parse.urlencode(params)}"
-        
-        # Make API request
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode())
-        
-        # Parse current weather
-        current = data.get("current", {})
-        current_temp = current.get("temperature_2m", 0)
-        weather_code = current.get("weather_code", 0)
-        wind_speed = current.get("wind_speed_10m", 0)
-        humidity = current.get("relative_humidity_2m", 0)
+        days = 1 if days < 1 else 7 if days > 7 else days
         
-        # Parse daily forecast (today)
-        daily = data.get("daily", {})
-        daily_times = daily.get("time", [])
-        daily_max_temp = daily.get("temperature_2m_max", [])
-        daily_min_temp = daily.get("temperature_2m_min", [])
-        daily_precip = daily.get("precipitation_sum", [])
-        daily_precip_prob = daily.get("precipitation_probability_max", [])
-        daily_weather_code = daily.get("weather_code", [])
-        
-        # Get today's forecast
-        today_max = daily_max_temp[0] if daily_max_temp else current_temp
-        today_min = daily_min_temp[0] if daily_min_temp else current_temp
-        today_precip = daily_precip[0] if daily_precip else 0
-        today_precip_prob = daily_precip_prob[0] if daily_precip_prob else 0
-        today_weather_code = daily_weather_code[0] if daily_weather_code else weather_code
-        
-        # Weather code interpretation (WMO codes)
-        def interpret_weather_code(code: int) -> str:
-            if code == 0:
-                return "Clear sky"
-            elif code in [1, 2, 3]:
-                return "Partly cloudy"
-            elif code in [45, 48]:
-                return "Foggy"
-            elif code in [51, 53, 55]:
-                return "Drizzle"
-            elif code in [56, 57]:
-                return "Freezing drizzle"
-            elif code in [61, 63, 65]:
-                return "Rain"
-            elif code in [66, 67]:
-                return "Freezing rain"
-            elif code in [71, 73, 75]:
-                return "Snow"
-            elif code == 77:
-                return "Snow grains"
-            elif code in [80, 81, 82]:
-                return "Rain showers"
-            elif code in [85, 86]:
-                return "Snow showers"
-            elif code == 95:
-                return "Thunderstorm"
-            elif code in [96, 99]:
-                return "Thunderstorm with hail"
+        cache_key = (round(latitude, 2), round(longitude, 2), days)
+        with _weather_cache_lock:
+            cached = _weather_cache.get(cache_key)
+            if cached is not None and time.monotonic() - cached[0] < WEATHER_CACHE_TTL:
+                _weather_cache.move_to_end(cache_key)
             else:
-                return "Unknown"
+                cached = None
+        if cached is not None:
+            return _dumps({"location": {"latitude": latitude, "longitude": longitude}, **cached[1]})
         
-        current_condition = interpret_weather_code(weather_code)
-        today_condition = interpret_weather_code(today_weather_code)
+        # Make API request over the pooled keep-alive client
+        response = await _weather_http.get(
+            f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}"
+            f"&forecast_days={days}&{_WEATHER_STATIC_QUERY}"
+        )
+        response.raise_for_status()
+        # Parse the raw body bytes directly; no intermediate str decode
+        data = _loads(response.content)
         
-        # Generate activity suggestions based on weather
-        suggestions = []
-        is_nice_weather = (weather_code in [0, 1, 2] and today_precip_prob < 30 and current_temp > 10)
-        is_rainy = (today_precip_prob > 50 or weather_code in [61, 63, 65, 66, 67, 80, 81, 82])
-        is_cold = (current_temp < 5 or today_min < 5)
-        is_hot = (current_temp > 30 or today_max > 30)
+        # Parse current weather and today's forecast; Open-Meteo returns every
+        # requested field, so index directly and only fall back on a partial payload
+        try:
+            current = data["current"]
+            daily = data["daily"]
+            current_temp = current["temperature_2m"]
+            weather_code = current["weather_code"]
+            wind_speed = current["wind_speed_10m"]
+            humidity = current["relative_humidity_2m"]
+            today_max = daily["temperature_2m_max"][0]
+            today_min = daily["temperature_2m_min"][0]
+            today_precip = daily["precipitation_sum"][0]
+            today_precip_prob = daily["precipitation_probability_max"][0]
+            today_weather_code = daily["weather_code"][0]
+        except (KeyError, IndexError, TypeError):
+            current = data.get("current", {})
+            current_temp = current.get("temperature_2m", 0)
+            weather_code = current.get("weather_code", 0)
+            wind_speed = current.get("wind_speed_10m", 0)
+            humidity = current.get("relative_humidity_2m", 0)
+            
+            daily = data.get("daily", {})
+            daily_max_temp = daily.get("temperature_2m_max", [])
+            daily_min_temp = daily.get("temperature_2m_min", [])
+            daily_precip = daily.get("precipitation_sum", [])
+            daily_precip_prob = daily.get("precipitation_probability_max", [])
+            daily_weather_code = daily.get("weather_code", [])
+            
+            today_max = daily_max_temp[0] if daily_max_temp else current_temp
+            today_min = daily_min_temp[0] if daily_min_temp else current_temp
+            today_precip = daily_precip[0] if daily_precip else 0
+            today_precip_prob = daily_precip_prob[0] if daily_precip_prob else 0
+            today_weather_code = daily_weather_code[0] if daily_weather_code else weather_code
         
-        if is_nice_weather and not is_cold:
-            suggestions.append("Great weather for outdoor activities like walking, exercise, or spending time in nature")
-        elif is_rainy:
-            suggestions.append("Rainy weather - consider indoor activities like journaling, reading, or meditation")
-        elif is_cold:
-            suggestions.append("Cold weather - cozy indoor activities would be best")
-        elif is_hot:
-            suggestions.append("Hot weather - stay hydrated and consider early morning or evening activities")
+        current_condition = _WEATHER_CODES.get(weather_code, "Unknown")
+        today_condition = _WEATHER_CODES.get(today_weather_code, "Unknown")
+        
+        # Generate activity suggestions based on weather; conditions are checked in
+        # priority order so only the winning branch's comparisons run
+        # (current_temp > 10 already rules out a cold current temperature)
+        if weather_code in _NICE_CODES and today_precip_prob < 30 and current_temp > 10 and today_min >= 5:
+            suggestions = _SUGGEST_NICE
+        elif today_precip_prob > 50 or weather_code in _RAIN_CODES:
+            suggestions = _SUGGEST_RAINY
+        elif current_temp < 5 or today_min < 5:
+            suggestions = _SUGGEST_COLD
+        elif current_temp > 30 or today_max > 30:
+            suggestions = _SUGGEST_HOT
         else:
-            suggestions.append("Moderate weather conditions - good for both indoor and outdoor activities")
+            suggestions = _DEFAULT_SUGGEST
+        
+        # Rounded once up front so the result dict below is plain local lookups
+        current_temp_c = round(current_temp, 1)
+        today_min_c = round(today_min, 1)
+        today_max_c = round(today_max, 1)
+        precip_prob_pct = round(today_precip_prob, 0)
+        precip_mm = round(today_precip, 1)
+        wind_kmh = round(wind_speed, 1)
+        humidity_pct = round(humidity, 0)
         
         # Build summary
-        result = {
-            "location": {
-                "latitude": latitude,
-                "longitude": longitude
-            },
+        forecast = {
             "current_weather": {
-                "temperature_celsius": round(current_temp, 1),
+                "temperature_celsius": current_temp_c,
                 "condition": current_condition,
-                "wind_speed_kmh": round(wind_speed, 1),
-                "humidity_percent": round(humidity, 0),
+                "wind_speed_kmh": wind_kmh,
+                "humidity_percent": humidity_pct,
                 "weather_code": weather_code
             },
             "today_forecast": {
-                "high_celsius": round(today_max, 1),
-                "low_celsius": round(today_min, 1),
+                "high_celsius": today_max_c,
+                "low_celsius": today_min_c,
                 "condition": today_condition,
-                "precipitation_mm": round(today_precip, 1),
-                "precipitation_probability_percent": round(today_precip_prob, 0),
+                "precipitation_mm": precip_mm,
+                "precipitation_probability_percent": precip_prob_pct,
                 "weather_code": today_weather_code
             },
             "activity_suggestions": suggestions,
-            "summary": f"Current: {round(current_temp, 1)}°C, {current_condition}. Today: {round(today_min, 1)}-{round(today_max, 1)}°C, {today_condition}. Precipitation chance: {round(today_precip_prob, 0)}%."
+            "summary": f"Current: {current_temp_c}°C, {current_condition}. Today: {today_min_c}-{today_max_c}°C, {today_condition}. Precipitation chance: {precip_prob_pct}%."
         }
         
-        return json.dumps(result, indent=2)
+        with _weather_cache_lock:
+            _weather_cache[cache_key] = (time.monotonic(), forecast)
+            _weather_cache.move_to_end(cache_key)
+            if len(_weather_cache) > _WEATHER_CACHE_MAX:
+                _weather_cache.popitem(last=False)
+        return _dumps({"location": {"latitude": latitude, "longitude": longitude}, **forecast})
     
-    except urllib.error.URLError as e:
-        import sys
-        error_msg = f"Error fetching weather data: {str(e)}"
-        print(f"ERROR: {error_msg}", file=sys.stderr)
-        return json.dumps({"error": error_msg})
     except Exception as e:
-        import sys
         error_msg = f"Error getting weather forecast: {str(e)}"
-        print(f"ERROR: {error_msg}", file=sys.stderr)
-        return json.dumps({"error": error_msg})
+        logger.exception("Weather forecast failed")
+        return _dumps({"error": error_msg})
+
+
+class _RequireBearerToken:
+    """ASGI middleware rejecting HTTP requests that lack the shared secret.
+
+    The tools act with the user's Google token and spend OpenAI credit, so only
+    the process that spawned this server (and set MCP_AUTH_TOKEN) may call them.
+    """
+
+    def __init__(self, app, token: str):
+        self.app = app
+        self.expected = f"Bearer {token}".encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            supplied = dict(scope["headers"]).get(b"authorization", b"")
+            if not hmac.compare_digest(supplied, self.expected):
+                await send({"type": "http.response.start", "status": 401, "headers": [(b"content-type", b"text/plain")]})
+                await send({"type": "http.response.body", "body": b"Unauthorized"})
+                return
+        await self.app(scope, receive, send)
+
+
+def _run_streamable_http() -> None:
+    import uvicorn
+
+    token = os.getenv("MCP_AUTH_TOKEN")
+    if not token:
+        raise RuntimeError("MCP_AUTH_TOKEN must be set to serve over streamable HTTP")
+
+    host = os.getenv("MCP_HTTP_HOST", "127.0.0.1")
+    port = int(os.getenv("MCP_HTTP_PORT", "8765"))
+    # Reject requests whose Host/Origin is not loopback, which blocks DNS rebinding
+    mcp.settings.transport_security = TransportSecuritySettings(
+        enable_dns_rebinding_protection=True,
+        allowed_hosts=["127.0.0.1:*", "localhost:*", f"{host}:*"],
+        allowed_origins=["http://127.0.0.1:*", "http://localhost:*"],
+    )
+    app = _RequireBearerToken(mcp.streamable_http_app(), token)
+    uvicorn.run(app, host=host, port=port, log_level=mcp.settings.log_level.lower())
 
 
 if __name__ == "__main__":
     try:
-        mcp.run(transport="stdio")
-    except Exception as e:
-        import sys
-        import traceback
-        print(f"ERROR in MCP server: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
+        # stdio by default (CLI agent); the backend spawns a private server over streamable HTTP
+        transport = os.getenv("MCP_TRANSPORT", "stdio")
+        if transport == "streamable-http":
+            _run_streamable_http()
+        else:
+            mcp.run(transport=transport)
+    except Exception:
+        logger.exception("MCP server failed")
         sys.exit(1)